@@ -6,8 +6,9 @@ source "$PYTHON_VENV_FILE"
 
 compiler="gcc"
 sanitizer="none"
+profile="debug"
 
-while getopts "c:s:" opt; do
+while getopts "c:s:p:" opt; do
 	case $opt in
 	c)
 		compiler="$OPTARG"
@@ -15,6 +16,9 @@ while getopts "c:s:" opt; do
 	s)
 		sanitizer="$OPTARG"
 		;;
+	p)
+		profile="$OPTARG"
+		;;
 	\?)
 		echo "Invalid option: -$OPTARG" >&2
 		exit 1
@@ -22,12 +26,28 @@ while getopts "c:s:" opt; do
 	esac
 done
 
-build_options="${compiler}-$(if [ "$sanitizer" == "none" ]; then echo "clean"; else echo "$sanitizer"; fi)"
+# The prefix names of the sanitizers as in SANITIZERS of main.py
+case "$sanitizer" in
+none) build_options="${compiler}-clean" ;;
+thread) build_options="${compiler}-tsan" ;;
+address) build_options="${compiler}-asan" ;;
+*)
+	echo "Invalid sanitizer: $sanitizer" >&2
+	exit 1
+	;;
+esac
+if [ "$profile" != "debug" ]; then
+	build_options="${build_options}-${profile}"
+fi
 
 # Set the PATH and LD_LIBRARY_PATH environment variables based on the provided compiler and sanitizer
 export PATH="$CZECHLIGHT_DIR/install/$build_options/bin:$CZECHLIGHT_DIR/install/$build_options/sbin:$PATH"
 export LD_LIBRARY_PATH="$CZECHLIGHT_DIR/install/$build_options/lib:$LD_LIBRARY_PATH"
 
+# Keep the sysrepo state of every prefix apart
+export SYSREPO_SHM_PREFIX="sr_${build_options}"
+export SYSREPO_REPOSITORY_PATH="$CZECHLIGHT_DIR/install/$build_options/sysrepo/repository"
+
 # Change the prompt to indicate the environment variables are set
 PS1="[czechlight-${compiler}] \[\e[1;32m\]\u@\h \[\e[1;34m\]\w \[\e[0m\]$ "
 
@@ -77,16 +97,21 @@ run-netconf-cli() {
 }
 
 build-netconf-cli() {
-	echo "Building the NETCONF-CLI with the ${compiler} compiler"
-	/home/ales/cesnet/czechlight-utils/main.py -a install -t netconf-cli -c "$compiler"
+	echo "Building the NETCONF-CLI in ${build_options}"
+	/home/ales/cesnet/czechlight-utils/main.py -a install -t netconf-cli -c "$compiler" -s "$sanitizer" -p "$profile"
 }
 
 build-dependencies() {
-	echo "Building the dependencies with the ${compiler} compiler"
-	/home/ales/cesnet/czechlight-utils/main.py -a install -t dependencies -c "$compiler"
+	echo "Building the dependencies in ${build_options}"
+	/home/ales/cesnet/czechlight-utils/main.py -a install -t dependencies -c "$compiler" -s "$sanitizer" -p "$profile"
 }
 
 build-czechlight() {
-	echo "Building the CzechLight with the ${compiler} compiler"
-	/home/ales/cesnet/czechlight-utils/main.py -a install -t all -c "$compiler"
+	echo "Building the CzechLight in ${build_options}"
+	/home/ales/cesnet/czechlight-utils/main.py -a install -t all -c "$compiler" -s "$sanitizer" -p "$profile"
+}
+
+watch-czechlight() {
+	echo "Rebuilding the CzechLight on changes in ${build_options}"
+	/home/ales/cesnet/czechlight-utils/main.py -a watch -t all -c "$compiler" -s "$sanitizer" -p "$profile"
 }
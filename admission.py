@@ -0,0 +1,102 @@
+import os
+import logging
+
+from scheduler import JobBudget
+
+logger = logging.getLogger(__name__)
+
+MEMINFO_FILE = "/proc/meminfo"
+
+# The share of the physical memory used as the default memory ceiling
+MEMORY_LIMIT_RATIO = 0.9
+
+# The peak memory of one job assumed for repositories that were never built
+DEFAULT_JOB_RSS = 2 ** 30
+
+# The interval in seconds in which the memory and the load are checked
+POLL_INTERVAL = 2.0
+
+# The minimal run time in seconds before a build tool is restarted to get more jobs
+RESTART_INTERVAL = 30.0
+
+
+def read_meminfo(meminfo_file: str = MEMINFO_FILE) -> dict:
+    """Reads the memory statistics of the system.
+
+    Args:
+        meminfo_file (str, optional): The path to the meminfo file.
+
+    Returns:
+        dict: The values in bytes by field name.
+    """
+
+    meminfo = dict()
+    with open(meminfo_file, 'r') as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields = value.split()
+            if fields and fields[0].isdigit():
+                meminfo[name] = int(fields[0]) * (1024 if fields[1:] == ["kB"] else 1)
+    return meminfo
+
+
+def memory_used(meminfo: dict) -> int:
+    """Returns the memory that can not be reclaimed, in bytes."""
+    return meminfo["MemTotal"] - meminfo["MemAvailable"]
+
+
+class AdmissionController(JobBudget):
+    """A job budget that only admits as many jobs as fit under a memory ceiling and the spare CPUs.
+
+    Every request states the expected peak memory of one of its jobs. It gets at most
+    as many jobs as fit into the memory left under the ceiling, counting the memory
+    reserved by the jobs granted earlier that may not have grown to their peak yet,
+    and at most as many jobs as there are CPUs not loaded by other processes. Running
+    builds are asked to restart their build tool when the memory use crosses the
+    ceiling or when twice as many jobs became available to them.
+    """
+
+    poll_interval = POLL_INTERVAL
+
+    def __init__(self, capacity: int, memory_limit: int = None) -> None:
+        super().__init__(capacity)
+        if memory_limit is None:
+            memory_limit = int(read_meminfo()["MemTotal"] * MEMORY_LIMIT_RATIO)
+        self.memory_limit = memory_limit
+        self._reserved = 0
+
+    def should_restart(self, granted: int, job_rss: int, elapsed: float) -> bool:
+        used = memory_used(read_meminfo())
+        if used > self.memory_limit and granted > 1:
+            logger.warning(f"{used / 2 ** 30:.1f} GiB of memory used, above the limit of "
+                           f"{self.memory_limit / 2 ** 30:.1f} GiB, reducing the jobs")
+            return True
+        if elapsed < RESTART_INTERVAL:
+            return False
+        with self._condition:
+            return self._available(job_rss, held=granted) >= 2 * granted
+
+    def _available(self, job_rss: int, held: int = 0) -> int:
+        granted = super()._available(job_rss, held)
+        if granted == 0:
+            return 0
+
+        job_rss = job_rss or DEFAULT_JOB_RSS
+        in_use = self.capacity - self._free - held
+        headroom = self.memory_limit - max(memory_used(read_meminfo()), self._reserved)
+        fitting = held + headroom // job_rss
+        # The load average counts the running jobs too, the rest of it is another load
+        other_load = max(0.0, os.getloadavg()[0] - in_use - held)
+        fitting = min(fitting, self.capacity - int(other_load))
+        if fitting <= 0:
+            # Let a single job through when nothing else is running so that builds never starve
+            return 0 if in_use > 0 else 1
+        return min(granted, fitting)
+
+    def _take(self, granted: int, job_rss: int) -> None:
+        super()._take(granted, job_rss)
+        self._reserved += granted * (job_rss or DEFAULT_JOB_RSS)
+
+    def _release(self, granted: int, job_rss: int) -> None:
+        super()._release(granted, job_rss)
+        self._reserved -= granted * (job_rss or DEFAULT_JOB_RSS)
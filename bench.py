@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import yaml
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import logging.config
+
+logger = logging.getLogger(__name__)
+
+# The benchmarked runs of main.py in their order, each starts from the state the previous one left
+SCENARIOS = [
+    ("download-cold", ["-a", "download", "-t", "dependencies"]),
+    ("update-noop", ["-a", "update", "-t", "dependencies"]),
+    ("install-cold", ["-a", "install", "-t", "dependencies"]),
+    ("install-noop", ["-a", "install", "-t", "dependencies"]),
+    ("clean", ["-a", "clean", "-t", "dependencies"]),
+    ("install-warm", ["-a", "install", "-t", "dependencies"]),
+]
+
+# The slowdown of a scenario against the baseline reported as a regression
+REGRESSION_RATIO = 0.1
+
+STUB_CMAKE = """#!{python}
+import os, re, sys, time
+
+args = sys.argv[1:]
+if args == ["--version"]:
+    sys.exit(print("cmake version 3.99.0-bench"))
+initial = dict()
+if args[0] == "-C":
+    with open(args[1]) as f:
+        for match in re.finditer(r'set\\((\\w+) "(.*)" CACHE (\\w+) ""\\)', f.read()):
+            initial[f"{{match.group(1)}}:{{match.group(3)}}"] = match.group(2)
+    args = args[2:]
+source, definitions = args[0], args[1:]
+time.sleep(float(os.environ.get("BENCH_CONFIGURE_SLEEP", "0")))
+entries = {{"CMAKE_HOME_DIRECTORY:INTERNAL": source, "CMAKE_GENERATOR:INTERNAL": "Ninja",
+           "CMAKE_C_FLAGS:STRING": os.environ.get("CFLAGS", ""),
+           "CMAKE_CXX_FLAGS:STRING": os.environ.get("CXXFLAGS", "")}}
+for name in ("EXE", "SHARED", "MODULE"):
+    entries[f"CMAKE_{{name}}_LINKER_FLAGS:STRING"] = os.environ.get("LDFLAGS", "")
+entries.update(initial)
+for definition in definitions:
+    match = re.fullmatch(r"-D([^:=]+)(?::([^=]*))?=(.*)", definition, re.DOTALL)
+    if match:
+        entries[f"{{match.group(1)}}:{{match.group(2) or 'UNINITIALIZED'}}"] = match.group(3)
+# Only the type sizes not known from the initial cache are probed
+for line in range(int(os.environ.get("BENCH_LINES", "0"))):
+    if f"SIZEOF_BENCH_TYPE_{{line}}:INTERNAL" not in entries:
+        print(f"-- Check size of bench_type_{{line}}")
+        entries[f"SIZEOF_BENCH_TYPE_{{line}}:INTERNAL"] = "8"
+with open("CMakeCache.txt", "w") as f:
+    f.write("".join(f"{{key}}={{value}}\\n" for key, value in entries.items()))
+open("build.ninja", "w").close()
+"""
+
+STUB_NINJA = """#!{python}
+import os, time
+
+lines = int(os.environ.get("BENCH_LINES", "0"))
+started = time.time()
+time.sleep(float(os.environ.get("BENCH_SLEEP", "0")))
+for line in range(1, lines + 1):
+    print(f"[{{line}}/{{lines}}] Building CXX object CMakeFiles/bench.dir/source{{line}}.cpp.o")
+ended = time.time()
+
+name = os.path.basename(os.getcwd())
+with open("CMakeCache.txt") as f:
+    prefix = [line.split("=", 1)[1].strip() for line in f if line.startswith("CMAKE_INSTALL_PREFIX")][0]
+with open(".ninja_log", "a") as f:
+    if f.tell() == 0:
+        f.write("# ninja log v5\\n")
+    for line in range(1, lines + 1):
+        f.write(f"0\\t{{int((ended - started) * 1000)}}\\t0\\tCMakeFiles/bench.dir/source{{line}}.cpp.o\\t0\\n")
+
+files = {{
+    f"lib/lib{{name}}.so.1": b"\\x7fELF" + os.urandom(4096),
+    f"include/{{name}}/{{name}}.h": b"#pragma once\\n",
+    f"lib/pkgconfig/{{name}}.pc": f"prefix={{prefix}}\\nLibs: -L${{{{prefix}}}}/lib -l{{name}}\\n".encode(),
+}}
+for path, content in files.items():
+    path = os.path.join(prefix, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+with open("install_manifest.txt", "w") as f:
+    f.write("\\n".join(os.path.join(prefix, path) for path in files))
+"""
+
+
+def create_stubs(bin_dir: str) -> None:
+    """Creates the stub cmake and ninja executables.
+
+    Args:
+        bin_dir (str): The directory to create the executables in.
+
+    Returns:
+        None
+    """
+
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, template in (("cmake", STUB_CMAKE), ("ninja", STUB_NINJA)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(template.format(python=sys.executable))
+        os.chmod(path, 0o755)
+
+
+def create_upstream_repositories(dependencies: dict, upstream_dir: str, files: int) -> dict:
+    """Creates a synthetic local Git repository for every dependency.
+
+    Args:
+        dependencies (dict): The dependency configuration.
+        upstream_dir (str): The directory to create the repositories in.
+        files (int): The number of source files of every repository.
+
+    Returns:
+        dict: The dependency configuration pointing to the synthetic repositories.
+    """
+
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@localhost",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@localhost")
+    synthetic = dict()
+    for name, data in dependencies.items():
+        repository = os.path.join(upstream_dir, name)
+        os.makedirs(repository)
+        with open(os.path.join(repository, "CMakeLists.txt"), 'w') as f:
+            f.write(f"project({name})\n")
+        for index in range(files):
+            with open(os.path.join(repository, f"source{index}.cpp"), 'w') as f:
+                f.write(f"int {name.replace('-', '_').replace('.', '_')}_{index}() {{ return {index}; }}\n")
+        for command in (["init", "-q", "-b", data["branch"]], ["add", "-A"], ["commit", "-q", "-m", "Initial"]):
+            subprocess.run(["git"] + command, cwd=repository, env=env, check=True)
+        synthetic[name] = dict(data, url=f"file://{repository}")
+        # Pinned commits do not exist in the synthetic repositories
+        synthetic[name].pop("commit", None)
+    return synthetic
+
+
+def run_scenarios(work_dir: str, settings: dict) -> dict:
+    """Runs every scenario once in a fresh CzechLight directory.
+
+    Args:
+        work_dir (str): The directory to create the synthetic setup in.
+        settings (dict): The benchmark settings.
+
+    Returns:
+        dict: The duration of every scenario in seconds.
+    """
+
+    root_dir = os.path.dirname(os.path.realpath(__file__))
+    orchestrator_dir = os.path.join(work_dir, "orchestrator")
+    shutil.copytree(root_dir, orchestrator_dir, ignore=shutil.ignore_patterns(
+        ".git", "venv", ".venv", "__pycache__", "reference", "src"))
+
+    with open(os.path.join(root_dir, "config", "dependencies.yaml"), 'r') as f:
+        dependencies = yaml.safe_load(f.read())
+    synthetic = create_upstream_repositories(dependencies, os.path.join(work_dir, "upstream"), settings["files"])
+    with open(os.path.join(orchestrator_dir, "config", "dependencies.yaml"), 'w') as f:
+        yaml.safe_dump(synthetic, f, sort_keys=False)
+
+    bin_dir = os.path.join(work_dir, "bin")
+    create_stubs(bin_dir)
+    env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}", BENCH_SLEEP=str(settings["sleep"]),
+               BENCH_CONFIGURE_SLEEP=str(settings["configure_sleep"]), BENCH_LINES=str(settings["lines"]))
+
+    czechlight_dir = os.path.join(work_dir, "czechlight")
+    durations = dict()
+    for name, arguments in SCENARIOS:
+        command = [sys.executable, os.path.join(orchestrator_dir, "main.py"), "-d", czechlight_dir,
+                   "-j", str(settings["jobs"])] + arguments
+        started = time.perf_counter()
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        durations[name] = time.perf_counter() - started
+        if process.returncode != 0:
+            raise RuntimeError(f"{name} failed:\n{process.stdout.decode(errors='replace')[-4000:]}")
+    return durations
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Compares benchmark results with a baseline.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of the baseline run.
+        threshold (float): The relative slowdown reported as a regression.
+
+    Returns:
+        list: The names of the scenarios that regressed.
+    """
+
+    regressions = list()
+    for name, result in results["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        before, after = baseline["scenarios"][name]["median"], result["median"]
+        change = (after - before) / before if before else 0.0
+        line = f"{name:<16} {before:8.3f}s -> {after:8.3f}s ({change:+.1%})"
+        if change > threshold:
+            regressions.append(name)
+            logger.warning(f"{line} REGRESSION")
+        else:
+            logger.info(line)
+    return regressions
+
+
+def main():
+    root_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(root_dir, "config", "logging.yaml"), 'r') as f:
+        logging.config.dictConfig(yaml.safe_load(f.read()))
+
+    arg_parser = argparse.ArgumentParser(description="Offline benchmark of the orchestration overhead of main.py")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="The number of times every scenario is run, the median is reported")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                            help="The --jobs passed to main.py")
+    arg_parser.add_argument("--sleep", type=float, default=0.2,
+                            help="The time every stub ninja run takes in seconds")
+    arg_parser.add_argument("--configure-sleep", type=float, default=0.05,
+                            help="The time every stub cmake run takes in seconds")
+    arg_parser.add_argument("--lines", type=int, default=200,
+                            help="The number of output lines of every stub cmake and ninja run")
+    arg_parser.add_argument("--files", type=int, default=20,
+                            help="The number of source files of every synthetic repository")
+    arg_parser.add_argument("-o", "--output", type=str,
+                            help="The file to write the results to as JSON")
+    arg_parser.add_argument("--compare", type=str, metavar="BASELINE",
+                            help="The results of an earlier run to compare with, regressions make the exit status 1")
+    arg_parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO,
+                            help="The relative slowdown reported as a regression")
+    args = arg_parser.parse_args()
+
+    settings = {
+        "jobs": args.jobs,
+        "sleep": args.sleep,
+        "configure_sleep": args.configure_sleep,
+        "lines": args.lines,
+        "files": args.files,
+    }
+
+    runs = {name: list() for name, _ in SCENARIOS}
+    for repeat in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix="czechlight-bench-", ignore_cleanup_errors=True) as work_dir:
+            for name, duration in run_scenarios(work_dir, settings).items():
+                runs[name].append(duration)
+        logger.info(f"Finished run {repeat + 1} of {args.repeat}")
+
+    with open(os.path.join(root_dir, "config", "dependencies.yaml"), 'r') as f:
+        repositories = len(yaml.safe_load(f.read()))
+    results = {"settings": settings, "repositories": repositories, "scenarios": dict()}
+    for name, durations in runs.items():
+        median = statistics.median(durations)
+        results["scenarios"][name] = {
+            "median": median,
+            "min": min(durations),
+            "runs": durations,
+            "repositories_per_second": repositories / median,
+        }
+        logger.info(f"{name:<16} {median:8.3f}s ({repositories / median:.1f} repositories/s)")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            logger.warning("The baseline was measured with other settings")
+        if compare(results, baseline, args.threshold):
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import sys
+import gzip
+import logging
+import resource
+import threading
+import contextlib
+import subprocess
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# The number of last output lines shown when a command fails
+TAIL_LINES = 50
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LoggedProcessError(subprocess.CalledProcessError):
+    """A failed command whose output is in a log file, which its message points to."""
+
+    def __init__(self, returncode: int, cmd: list, log_file: str) -> None:
+        super().__init__(returncode, cmd)
+        self.log_file = log_file
+
+    def __str__(self) -> str:
+        return f"{super().__str__()} See {self.log_file}"
+
+
+def phase_log_file(log_dir: str, repository_name: str, phase: str) -> str:
+    """Returns the path to the compressed log of one phase of a repository build.
+
+    Args:
+        log_dir (str): The log directory of the prefix.
+        repository_name (str): The name of the repository.
+        phase (str): The name of the phase.
+
+    Returns:
+        str: The path to the log file.
+    """
+
+    return os.path.join(log_dir, repository_name, f"{phase}.log.gz")
+
+
+def run_logged(command: list, cwd: str, env: dict, log_file: str, tail_lines: int = TAIL_LINES,
+               monitor=None, on_line=None, append: bool = False) -> resource.struct_rusage:
+    """Runs a command and streams its combined output into a compressed log file.
+
+    Only the last lines of the output are kept in memory, they are logged when the
+    command fails.
+
+    Args:
+        command (list): The command to run.
+        cwd (str): The working directory of the command.
+        env (dict): The environment variables.
+        log_file (str): The path to the compressed log file, None to pass the output through to the console.
+        tail_lines (int, optional): The number of last lines to log on failure.
+        monitor (callable, optional): Called in a separate thread with the process and an event set
+            once the command finishes. Returns whether it interrupted the command, which is then
+            not considered failed.
+        on_line (callable, optional): Called with every complete line of the output, as bytes.
+        append (bool, optional): Whether to add to the log file instead of replacing it, e.g. for a restarted command.
+
+    Returns:
+        resource.struct_rusage: The resource usage of the command and its descendants.
+
+    Raises:
+        subprocess.CalledProcessError: If the command fails, a LoggedProcessError with a log file.
+    """
+
+    tail = deque(maxlen=tail_lines)
+    partial = b""
+    if log_file is not None:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    with contextlib.ExitStack() as stack:
+        log = None
+        if log_file is not None:
+            log = stack.enter_context(gzip.open(log_file, "ab" if append else "wb", compresslevel=1))
+        output = None if log is None and on_line is None else subprocess.PIPE
+        # A logical working directory keeps the paths under a symlinked build directory stable
+        process = stack.enter_context(subprocess.Popen(command, cwd=cwd, env=dict(env, PWD=cwd),
+                                                       stdin=subprocess.DEVNULL, stdout=output,
+                                                       stderr=subprocess.STDOUT))
+        finished = threading.Event()
+        interrupted = list()
+        if monitor is not None:
+            watcher = threading.Thread(target=lambda: interrupted.append(monitor(process, finished)), daemon=True)
+            watcher.start()
+
+        try:
+            while output is not None:
+                chunk = process.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if log is not None:
+                    log.write(chunk)
+                else:
+                    sys.stdout.buffer.write(chunk)
+                    sys.stdout.flush()
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()[-CHUNK_SIZE:]
+                tail.extend(lines)
+                if on_line is not None:
+                    for line in lines:
+                        on_line(line)
+            # Reap the process here, Popen does not report the resource usage
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        finally:
+            finished.set()
+        if monitor is not None:
+            watcher.join()
+    if partial:
+        tail.append(partial)
+
+    if process.returncode != 0 and not any(interrupted):
+        if log_file is not None:
+            lines = "".join(f"\n  | {line.decode(errors='replace').rstrip()}" for line in tail)
+            logger.error(f"Last {len(tail)} lines of {log_file}:{lines}")
+        if log_file is not None:
+            raise LoggedProcessError(process.returncode, command, log_file)
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return usage
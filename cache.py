@@ -0,0 +1,380 @@
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tarfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Replaces the installation directory in the text files of an artifact
+PREFIX_PLACEHOLDER = b"@CZECHLIGHT_INSTALL_PREFIX@"
+
+# The variables of the build environment that select the compiler and sanitizer
+COMPILER_ENV_VARIABLES = ["CC", "CXX", "CFLAGS", "CXXFLAGS", "LDFLAGS"]
+
+METADATA_NAME = ".czechlight-artifact.json"
+
+
+def artifact_key(repository_name: str, stamp: dict, cmake_args: list, env: dict, upstream: dict) -> str:
+    """Computes the key of the installed files of a build.
+
+    Unlike the build stamp, the key does not depend on the directories of the prefix,
+    so that builds can be shared between prefix directories.
+
+    Args:
+        repository_name (str): The name of the repository.
+        stamp (dict): The build stamp of the repository.
+        cmake_args (list): The repository specific CMake arguments.
+        env (dict): The build environment.
+        upstream (dict): The artifact keys of the upstream repositories by name.
+
+    Returns:
+        str: The key, or None if the build can not be cached.
+    """
+
+    if stamp is None or stamp["source"]["dirty"] is not None or None in upstream.values():
+        return None
+
+    key = {
+        "repository": repository_name,
+        "commit": stamp["source"]["head"],
+        "cmake": cmake_args,
+        "env": {name: env.get(name) for name in COMPILER_ENV_VARIABLES},
+        "upstream": upstream,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def read_manifest(build_dir: str) -> list:
+    """Reads the files installed by the last `ninja install` from the CMake install manifest.
+
+    Args:
+        build_dir (str): The build directory of the repository.
+
+    Returns:
+        list: The absolute paths of the installed files.
+    """
+
+    manifest = os.path.join(build_dir, "install_manifest.txt")
+    if not os.path.exists(manifest):
+        return list()
+    with open(manifest, 'r') as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+def pack_artifact(artifact_path: str, repository_name: str, install_dir: str, build_dir: str) -> dict:
+    """Packs the files listed in the install manifest of a build into a tarball.
+
+    The installation directory in text files is replaced by a placeholder.
+
+    Args:
+        artifact_path (str): The path to the tarball to create.
+        repository_name (str): The name of the repository.
+        install_dir (str): The directory where the installation files are located.
+        build_dir (str): The build directory of the repository.
+
+    Returns:
+        dict: The metadata of the artifact.
+    """
+
+    files = read_manifest(build_dir)
+    prefix = os.fsencode(install_dir)
+    relocated = list()
+    bound = False
+
+    with tarfile.open(artifact_path, "w:gz") as tar:
+        for path in files:
+            name = os.path.relpath(path, install_dir)
+            if name.startswith(os.pardir) or not os.path.lexists(path):
+                continue
+            info = tar.gettarinfo(path, arcname=name)
+            if not info.isfile():
+                tar.addfile(info)
+                continue
+            with open(path, "rb") as f:
+                content = f.read()
+            if prefix in content:
+                if b"\0" in content:
+                    bound = True
+                else:
+                    content = content.replace(prefix, PREFIX_PLACEHOLDER)
+                    info.size = len(content)
+                    relocated.append(name)
+            tar.addfile(info, io.BytesIO(content))
+
+    return {
+        "repository": repository_name,
+        "created": time.time(),
+        "files": len(files),
+        "relocated": relocated,
+        "prefix": install_dir if bound else None,
+    }
+
+
+def _member_path(install_dir: str, member: tarfile.TarInfo) -> str:
+    # Artifacts can come from other hosts, a member may only install a file or link below the installation directory
+    for name in (member.name, member.linkname if member.islnk() else ""):
+        if os.path.isabs(name) or os.pardir in name.split("/"):
+            raise ValueError(f"Artifact member {member.name} points outside of {install_dir}")
+    if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+        raise ValueError(f"Artifact member {member.name} is not a file, directory or link")
+    path = os.path.join(install_dir, member.name)
+    root = os.path.realpath(install_dir)
+    if os.path.commonpath([root, os.path.realpath(os.path.dirname(path))]) != root:
+        raise ValueError(f"Artifact member {member.name} points outside of {install_dir}")
+    return path
+
+
+def unpack_artifact(artifact, metadata: dict, install_dir: str, build_dir: str) -> None:
+    """Installs the files of a tarball created by pack_artifact().
+
+    The list of installed files is written into the install manifest of the build
+    directory, as if they were installed by `ninja install`.
+
+    Args:
+        artifact (file): The opened tarball.
+        metadata (dict): The metadata of the artifact.
+        install_dir (str): The directory where the installation files are located.
+        build_dir (str): The build directory of the repository.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If a member of the tarball would be installed outside of the installation directory.
+    """
+
+    installed = list()
+    prefix = os.fsencode(install_dir)
+    # The extraction filters only exist since Python 3.11.4, the members are checked by _member_path() anyway
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "data_filter") else dict()
+    with tarfile.open(fileobj=artifact, mode="r:gz") as tar:
+        for member in tar:
+            if member.name == METADATA_NAME:
+                continue
+            path = _member_path(install_dir, member)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            if member.name in metadata["relocated"]:
+                content = tar.extractfile(member).read().replace(PREFIX_PLACEHOLDER, prefix)
+                with open(path, "wb") as f:
+                    f.write(content)
+                os.chmod(path, member.mode)
+            else:
+                tar.extract(member, install_dir, **extract_args)
+            installed.append(path)
+
+    _write_manifest(build_dir, installed)
+
+
+def link_installed(source_install_dir: str, source_build_dir: str, install_dir: str, build_dir: str) -> None:
+    """Installs the files of a build into another installation directory by hardlinking them.
+
+    Text files containing the source installation directory are copied with it
+    replaced. The list of installed files is written into the install manifest of the
+    build directory, as if they were installed by `ninja install`.
+
+    Args:
+        source_install_dir (str): The installation directory the build was installed into.
+        source_build_dir (str): The build directory of the repository.
+        install_dir (str): The installation directory to install the files into.
+        build_dir (str): The build directory to write the install manifest to.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If a binary file has the source installation directory compiled in.
+    """
+
+    source_prefix = os.fsencode(source_install_dir)
+    prefix = os.fsencode(install_dir)
+    installed = list()
+    for source in read_manifest(source_build_dir):
+        name = os.path.relpath(source, source_install_dir)
+        if name.startswith(os.pardir) or not os.path.lexists(source):
+            continue
+        path = os.path.join(install_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+
+        if os.path.islink(source):
+            target = os.readlink(source)
+            if target.startswith(source_install_dir + os.sep):
+                target = install_dir + target[len(source_install_dir):]
+            os.symlink(target, path)
+        else:
+            with open(source, "rb") as f:
+                content = f.read()
+            if source_prefix in content:
+                if b"\0" in content:
+                    raise ValueError(f"{source} has {source_install_dir} compiled in")
+                with open(path, "wb") as f:
+                    f.write(content.replace(source_prefix, prefix))
+                shutil.copymode(source, path)
+            else:
+                try:
+                    os.link(source, path)
+                except OSError:
+                    shutil.copy2(source, path)
+        installed.append(path)
+
+    _write_manifest(build_dir, installed)
+
+
+def _write_manifest(build_dir: str, installed: list) -> None:
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, "install_manifest.txt"), 'w') as f:
+        f.write("\n".join(installed))
+
+
+class ArtifactCache:
+    """A local content-addressed store of installed files with LRU eviction.
+
+    Every artifact is a tarball of the files installed by one build, with the
+    installation directory in text files replaced by a placeholder. Artifacts of
+    binaries that have the installation directory compiled in can only be unpacked
+    into the same directory.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.tar.gz")
+
+    def _metadata_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def entries(self) -> list:
+        """Lists the stored artifacts.
+
+        Returns:
+            list: The metadata of the artifacts, least recently used first.
+        """
+
+        entries = list()
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".tar.gz"):
+                continue
+            key = entry.name[:-len(".tar.gz")]
+            try:
+                with open(self._metadata_path(key), 'r') as f:
+                    metadata = json.load(f)
+                stat = entry.stat()
+            except (OSError, ValueError):
+                continue
+            metadata.update(key=key, size=stat.st_size, last_used=stat.st_mtime)
+            entries.append(metadata)
+        return sorted(entries, key=lambda metadata: metadata["last_used"])
+
+    def unpack(self, key: str, install_dir: str, build_dir: str) -> bool:
+        """Installs the files of an artifact.
+
+        The list of installed files is written into the install manifest of the build
+        directory, as if they were installed by `ninja install`.
+
+        Args:
+            key (str): The key of the artifact.
+            install_dir (str): The directory where the installation files are located.
+            build_dir (str): The build directory of the repository.
+
+        Returns:
+            bool: Whether the artifact was found and installed.
+        """
+
+        try:
+            with open(self._metadata_path(key), 'r') as f:
+                metadata = json.load(f)
+            artifact = open(self._path(key), "rb")
+        except (OSError, ValueError):
+            return False
+
+        with artifact:
+            if metadata["prefix"] is not None and metadata["prefix"] != install_dir:
+                logger.info(f"Cached {metadata['repository']} is bound to {metadata['prefix']}")
+                return False
+
+            os.utime(self._path(key))
+            try:
+                unpack_artifact(artifact, metadata, install_dir, build_dir)
+            except (ValueError, tarfile.TarError) as e:
+                logger.warning(f"Failed to install {metadata['repository']} from the cache: {e}")
+                return False
+
+        logger.info(f"Installed {metadata['repository']} from the cache ({key[:12]})")
+        return True
+
+    def store(self, key: str, repository_name: str, install_dir: str, build_dir: str) -> None:
+        """Packs the files listed in the install manifest of a build into an artifact.
+
+        Args:
+            key (str): The key of the artifact.
+            repository_name (str): The name of the repository.
+            install_dir (str): The directory where the installation files are located.
+            build_dir (str): The build directory of the repository.
+
+        Returns:
+            None
+        """
+
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        metadata = pack_artifact(tmp_path, repository_name, install_dir, build_dir)
+        with open(f"{self._metadata_path(key)}.tmp", 'w') as f:
+            json.dump(metadata, f)
+        with self._lock:
+            os.replace(f"{self._metadata_path(key)}.tmp", self._metadata_path(key))
+            os.replace(tmp_path, self._path(key))
+
+        logger.info(f"Stored {repository_name} in the cache ({key[:12]})")
+        self.prune()
+
+    def prune(self, max_size: int = None) -> list:
+        """Evicts the least recently used artifacts until the store fits into its size limit.
+
+        Args:
+            max_size (int, optional): The size limit in bytes, the limit of the store by default.
+
+        Returns:
+            list: The metadata of the evicted artifacts.
+        """
+
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            entries = self.entries()
+            total_size = sum(entry["size"] for entry in entries)
+            evicted = list()
+            for entry in entries:
+                if total_size <= max_size:
+                    break
+                for path in (self._path(entry["key"]), self._metadata_path(entry["key"])):
+                    if os.path.exists(path):
+                        os.remove(path)
+                total_size -= entry["size"]
+                evicted.append(entry)
+                logger.info(f"Evicted {entry['repository']} from the cache ({entry['key'][:12]})")
+        return evicted
+
+    def stats(self) -> dict:
+        """Summarizes the contents of the store.
+
+        Returns:
+            dict: The number of artifacts, their total size and the size limit in bytes.
+        """
+
+        entries = self.entries()
+        return {
+            "artifacts": len(entries),
+            "size": sum(entry["size"] for entry in entries),
+            "max_size": self.max_size,
+            "entries": entries,
+        }
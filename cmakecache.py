@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import functools
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+DEFINITION = re.compile(r"-D([^:=]+)(?::([^=]*))?=(.*)", re.DOTALL)
+CACHE_ENTRY = re.compile(r"([^#/][^:=]*):([^=]*)=(.*)")
+
+TRUE_VALUES = {"ON", "YES", "TRUE", "Y", "1"}
+FALSE_VALUES = {"OFF", "NO", "FALSE", "N", "0", ""}
+
+# The cache entries that CMake initializes from the environment on the first configure
+COMPILER_ENTRIES = {"CC": "CMAKE_C_COMPILER", "CXX": "CMAKE_CXX_COMPILER"}
+FLAG_ENTRIES = {
+    "CFLAGS": ["CMAKE_C_FLAGS"],
+    "CXXFLAGS": ["CMAKE_CXX_FLAGS"],
+    "LDFLAGS": ["CMAKE_EXE_LINKER_FLAGS", "CMAKE_SHARED_LINKER_FLAGS", "CMAKE_MODULE_LINKER_FLAGS"],
+}
+
+# The internal cache entries with the results of configure checks that only depend on the toolchain, shared
+# by the repositories built with it: the pthread check of FindThreads, check_type_size() and compiler flag
+# checks. Other checks, e.g. check_symbol_exists(), also depend on the definitions, include directories and
+# libraries of the repository and on what is installed in the prefix already, so every repository runs them.
+PROBE_ENTRY = re.compile(r"CMAKE_HAVE_LIBC_PTHREAD|(HAVE_)?SIZEOF_\w+|\w*COMPILER_SUPPORTS_\w+")
+
+# The programs found by find_program() that are shared as well, unless they are in a private directory
+PROGRAM_ENTRY = re.compile(r"\w+_EXECUTABLE")
+
+LOCK_FILE_NAME = ".lock"
+
+
+def read_cmake_cache(build_dir: str) -> dict:
+    """Reads the entries of the CMakeCache.txt of a build directory.
+
+    Args:
+        build_dir (str): The build directory.
+
+    Returns:
+        dict: The (type, value) tuples by entry name, or None if there is no cache.
+    """
+
+    cache_file = os.path.join(build_dir, "CMakeCache.txt")
+    if not os.path.exists(cache_file):
+        return None
+
+    entries = dict()
+    with open(cache_file, 'r', errors="replace") as f:
+        for line in f:
+            match = CACHE_ENTRY.fullmatch(line.rstrip("\n"))
+            if match:
+                name, entry_type, value = match.groups()
+                entries[name.strip('"')] = (entry_type, value)
+    return entries
+
+
+def _normalize(entry_type: str, value: str) -> str:
+    if value.upper() in TRUE_VALUES:
+        return "ON"
+    if value.upper() in FALSE_VALUES:
+        return "OFF"
+    if entry_type in ("PATH", "FILEPATH") and value:
+        return os.path.normpath(value)
+    return value
+
+
+def configure_changes(build_dir: str, cmake_command: list, env: dict) -> list:
+    """Compares a CMake command line and the build environment with an existing configuration.
+
+    Args:
+        build_dir (str): The build directory.
+        cmake_command (list): The CMake command line.
+        env (dict): The build environment.
+
+    Returns:
+        list: The (description, fresh) tuples of the differences, where fresh tells that
+            the cache has to be removed because CMake would not pick up the change. An
+            empty list if the configuration is up to date.
+    """
+
+    cache = read_cmake_cache(build_dir)
+    if cache is None or not os.path.exists(os.path.join(build_dir, "build.ninja")):
+        return [("not configured yet", False)]
+
+    changes = list()
+
+    # A build directory moved between RAM and disk has to be configured again where it is now
+    cache_dir = cache.get("CMAKE_CACHEFILE_DIR", (None, None))[1]
+    if cache_dir is not None and os.path.realpath(cache_dir) != os.path.realpath(build_dir):
+        changes.append((f"build directory {cache_dir} -> {build_dir}", True))
+
+    definitions = dict()
+    for arg in cmake_command[1:]:
+        match = DEFINITION.fullmatch(arg)
+        if match:
+            name, entry_type, value = match.groups()
+            definitions[name] = (entry_type, value)
+        elif arg.startswith("-G"):
+            generator = cache.get("CMAKE_GENERATOR", (None, None))[1]
+            if generator != arg[2:]:
+                changes.append((f"generator {generator} -> {arg[2:]}", True))
+        elif not arg.startswith("-"):
+            source = cache.get("CMAKE_HOME_DIRECTORY", (None, None))[1]
+            if source is not None and os.path.normpath(source) != os.path.normpath(arg):
+                changes.append((f"source directory {source} -> {arg}", True))
+
+    for name, (entry_type, value) in definitions.items():
+        if name not in cache:
+            changes.append((f"{name} unset -> {value}", False))
+            continue
+        cached_type, cached_value = cache[name]
+        if _normalize(entry_type or cached_type, value) != _normalize(cached_type, cached_value):
+            changes.append((f"{name} {cached_value} -> {value}", False))
+
+    for variable, name in COMPILER_ENTRIES.items():
+        if name not in cache or not env.get(variable):
+            continue
+        compiler = shutil.which(env[variable], path=env.get("PATH"))
+        cached_compiler = cache[name][1]
+        if compiler is None or os.path.realpath(compiler) != os.path.realpath(cached_compiler):
+            changes.append((f"{variable} {cached_compiler} -> {compiler or env[variable]}", True))
+
+    for variable, names in FLAG_ENTRIES.items():
+        flags = env.get(variable, "").split()
+        for name in names:
+            if name in cache and cache[name][1].split() != flags:
+                changes.append((f"{variable} '{cache[name][1]}' -> '{' '.join(flags)}'", True))
+                break
+
+    return changes
+
+
+def remove_cmake_cache(build_dir: str) -> None:
+    """Removes the CMake cache of a build directory so that the next configure starts afresh.
+
+    Args:
+        build_dir (str): The build directory.
+
+    Returns:
+        None
+    """
+
+    cache_file = os.path.join(build_dir, "CMakeCache.txt")
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    cmake_files = os.path.join(build_dir, "CMakeFiles")
+    if os.path.exists(cmake_files):
+        shutil.rmtree(cmake_files)
+    logger.info(f"Removed the CMake cache of {build_dir}")
+
+
+@functools.lru_cache(maxsize=None)
+def _version(program: str) -> str:
+    try:
+        return subprocess.run([program, "--version"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout
+    except OSError:
+        return ""
+
+
+def resolve_program(name: str, env: dict) -> list:
+    """Identifies the program a build runs for a name.
+
+    Args:
+        name (str): The name of the program, or a path to it.
+        env (dict): The build environment, whose PATH the program is looked up in.
+
+    Returns:
+        list: The real path of the program and its version output, None for both if it is not found.
+    """
+
+    program = shutil.which(name, path=env.get("PATH"))
+    if program is None:
+        return [None, None]
+    program = os.path.realpath(program)
+    return [program, _version(program)]
+
+
+def toolchain_key(env: dict, build_type: str) -> str:
+    """Identifies the toolchain that the results of configure checks depend on.
+
+    Args:
+        env (dict): The build environment.
+        build_type (str): The CMake build type.
+
+    Returns:
+        str: A hash of the compilers and their versions, the flags, the build type, the CMake version and
+            the kinds of entries that are shared.
+    """
+
+    digest = hashlib.sha256()
+    for variable in ("CC", "CXX", "cmake"):
+        digest.update(json.dumps([variable] + resolve_program(env.get(variable, variable), env)).encode())
+    digest.update(json.dumps([env.get(variable, "") for variable in FLAG_ENTRIES] + [build_type]).encode())
+    # Results gathered with other shared entries are not reused
+    digest.update(json.dumps([PROBE_ENTRY.pattern, PROGRAM_ENTRY.pattern]).encode())
+    return digest.hexdigest()
+
+
+def _quote(value: str) -> str:
+    return '"' + re.sub(r'([\\"$])', r"\\\1", value) + '"'
+
+
+class ProbeCache:
+    """The results of configure checks, gathered from the builds of every toolchain.
+
+    After every configure, the check results and found programs in the CMake cache are
+    added to the results of the toolchain. Only the checks whose result depends on the
+    toolchain alone are shared. The results of a toolchain are written as an initial
+    cache script that pre-seeds the first configure of every other repository, so
+    those checks run once per toolchain. A result that differs between repositories
+    anyway is never shared again. Other compilers, compiler versions, flags or a new CMake make another
+    toolchain, which starts with no results.
+    """
+
+    def __init__(self, cache_dir: str, private_dirs: list = ()) -> None:
+        self.cache_dir = cache_dir
+        self.private_dirs = [os.path.join(os.path.realpath(directory), "") for directory in private_dirs]
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _results_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _script_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.cmake")
+
+    def initial_cache(self, env: dict, build_type: str) -> str:
+        """Returns the initial cache script of a toolchain to pass to `cmake -C`.
+
+        Args:
+            env (dict): The build environment.
+            build_type (str): The CMake build type.
+
+        Returns:
+            str: The path to the script, or None if nothing is known about the toolchain yet.
+        """
+
+        script = self._script_path(toolchain_key(env, build_type))
+        return script if os.path.exists(script) else None
+
+    def _shared(self, name: str, entry_type: str, value: str) -> bool:
+        if entry_type == "INTERNAL":
+            return PROBE_ENTRY.fullmatch(name) is not None
+        if entry_type == "FILEPATH" and PROGRAM_ENTRY.fullmatch(name) and os.path.isabs(value):
+            value = os.path.realpath(value)
+            return not any(value.startswith(directory) for directory in self.private_dirs)
+        return False
+
+    def record(self, build_dir: str, cmake_command: list, env: dict, build_type: str) -> None:
+        """Adds the configure check results of a configured build directory to its toolchain.
+
+        Args:
+            build_dir (str): The build directory.
+            cmake_command (list): The CMake command line, the entries it defines are not results.
+            env (dict): The build environment.
+            build_type (str): The CMake build type.
+
+        Returns:
+            None
+        """
+
+        cache = read_cmake_cache(build_dir)
+        if cache is None:
+            return
+        defined = {match.group(1) for match in map(DEFINITION.fullmatch, cmake_command[1:]) if match}
+        found = {name: [entry_type, value] for name, (entry_type, value) in cache.items()
+                 if name not in defined and self._shared(name, entry_type, value)}
+        key = toolchain_key(env, build_type)
+
+        with self._lock, open(os.path.join(self.cache_dir, LOCK_FILE_NAME), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self._results_path(key), 'r') as f:
+                    results = json.load(f)
+            except (OSError, ValueError):
+                results = dict()
+
+            # A conflicting result is kept as None so that it is never shared again
+            changed = False
+            for name, result in found.items():
+                if name not in results:
+                    results[name] = result
+                    changed = True
+                elif results[name] is not None and results[name] != result:
+                    logger.info(f"Not sharing {name} any more, {os.path.basename(build_dir)} found "
+                                f"{result[1]!r} instead of {results[name][1]!r}")
+                    results[name] = None
+                    changed = True
+            if not changed:
+                return
+
+            with open(f"{self._results_path(key)}.tmp", 'w') as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+            os.replace(f"{self._results_path(key)}.tmp", self._results_path(key))
+            with open(f"{self._script_path(key)}.tmp", 'w') as f:
+                f.write(f"# The configure check results of the toolchain {key}\n")
+                for name, result in sorted(results.items()):
+                    if result is not None:
+                        f.write(f"set({name} {_quote(result[1])} CACHE {result[0]} \"\")\n")
+            os.replace(f"{self._script_path(key)}.tmp", self._script_path(key))
@@ -0,0 +1,82 @@
+import os
+import stat
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR_NAME = "store"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dedup(files: list, store_dir: str, workers: int = None) -> dict:
+    """Replaces identical files by hardlinks to a single copy in a content-addressed store.
+
+    Files are identical when their contents and permissions are. The store keeps a
+    link to every distinct file, objects no longer linked from anywhere else are
+    removed. The store has to be on the same filesystem as the files.
+
+    Args:
+        files (list): The paths of the files to deduplicate, e.g. from the install manifests.
+        store_dir (str): The directory of the store.
+        workers (int, optional): The number of files hashed at once.
+
+    Returns:
+        dict: The number of `files` seen, of the `linked` ones and the `saved` bytes.
+    """
+
+    # Files linked together already are hashed once
+    inodes = dict()
+    for path in dict.fromkeys(files):
+        try:
+            info = os.lstat(path)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISREG(info.st_mode) and info.st_size > 0:
+            inodes.setdefault((info.st_dev, info.st_ino), list()).append((path, info))
+
+    sources = [paths[0][0] for paths in inodes.values()]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = dict(zip(inodes, executor.map(_digest, sources)))
+
+    linked = 0
+    saved = 0
+    for inode, paths in inodes.items():
+        mode = stat.S_IMODE(paths[0][1].st_mode)
+        key = f"{digests[inode]}-{mode:o}"
+        store_file = os.path.join(store_dir, key[:2], key)
+        try:
+            store_info = os.lstat(store_file)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(store_file), exist_ok=True)
+            os.link(paths[0][0], store_file)
+            continue
+        if (store_info.st_dev, store_info.st_ino) == inode:
+            continue
+        for path, _ in paths:
+            tmp_path = f"{path}.dedup"
+            os.link(store_file, tmp_path)
+            os.replace(tmp_path, path)
+            linked += 1
+        # The replaced copy is gone once none of its links are left
+        if paths[0][1].st_nlink == len(paths):
+            saved += paths[0][1].st_size
+
+    for directory, _, names in os.walk(store_dir):
+        for name in names:
+            store_file = os.path.join(directory, name)
+            if os.lstat(store_file).st_nlink == 1:
+                os.remove(store_file)
+
+    logger.info(f"Linked {linked} of {len(files)} files to identical ones, saving {saved / 2 ** 20:.1f} MiB")
+    return {"files": len(files), "linked": linked, "saved": saved}
@@ -0,0 +1,395 @@
+import os
+import hmac
+import json
+import queue
+import hashlib
+import shutil
+import socket
+import time
+import logging
+import tarfile
+import tempfile
+import threading
+
+from cache import pack_artifact, read_manifest, unpack_artifact
+from history import BuildHistory
+from stamps import STAMP_DIR_NAME, read_stamp, write_stamp
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+
+CHUNK_SIZE = 64 * 1024
+
+# The environment variable with the secret shared by the coordinator and its agents
+TOKEN_VARIABLE = "CZECHLIGHT_AGENT_TOKEN"
+
+# The time in seconds a peer has to complete the handshake
+HANDSHAKE_TIMEOUT = 10.0
+
+# The time in seconds a unit waits for an agent to connect while there is none
+AGENT_TIMEOUT = 300.0
+
+# The interval in seconds between the checks for connected agents while waiting for an idle one
+IDLE_POLL_INTERVAL = 1.0
+
+
+def parse_address(address: str, default_host: str = "localhost") -> tuple:
+    """Parses a [HOST:]PORT address.
+
+    Args:
+        address (str): The address.
+        default_host (str, optional): The host used when the address has none.
+
+    Returns:
+        tuple: The (host, port) tuple.
+    """
+
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+
+def _proof(token: str, nonce: str) -> str:
+    return hmac.new(token.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def _nonce() -> str:
+    return os.urandom(16).hex()
+
+
+class Connection:
+    """A TCP connection exchanging JSON messages, each optionally followed by a binary payload.
+
+    Every message is a line of JSON. A message with a `size` field is followed by
+    that many bytes of payload.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._socket = sock
+        self._stream = sock.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._stream.close()
+        self._socket.close()
+
+    def send(self, message: dict, payload_file: str = None) -> None:
+        """Sends a message, safe to be called from several threads.
+
+        Args:
+            message (dict): The message.
+            payload_file (str, optional): The file to send as the payload of the message.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            if payload_file is not None:
+                message = dict(message, size=os.path.getsize(payload_file))
+            self._stream.write(json.dumps(message).encode() + b"\n")
+            if payload_file is not None:
+                with open(payload_file, "rb") as f:
+                    shutil.copyfileobj(f, self._stream, CHUNK_SIZE)
+            self._stream.flush()
+
+    def receive(self, payload_file: str = None) -> dict:
+        """Receives a message.
+
+        Args:
+            payload_file (str, optional): The file to store the payload of the message in.
+
+        Returns:
+            dict: The message.
+
+        Raises:
+            ConnectionError: If the peer closed the connection.
+        """
+
+        line = self._stream.readline()
+        if not line:
+            raise ConnectionError("Connection closed")
+        message = json.loads(line)
+
+        remaining = message.get("size", 0)
+        if not remaining:
+            return message
+        with open(payload_file or os.devnull, "wb") as f:
+            while remaining:
+                chunk = self._stream.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError("Connection closed in the middle of a payload")
+                f.write(chunk)
+                remaining -= len(chunk)
+        return message
+
+
+class _Agent:
+    def __init__(self, name: str, connection: Connection) -> None:
+        self.name = name
+        self.connection = connection
+        # The units whose artifacts the agent has installed
+        self.installed = set()
+
+
+class Coordinator:
+    """Hands build units to the worker agents connected over TCP.
+
+    Agents can connect at any time. The coordinator and every agent prove to each
+    other that they know the shared token by signing a nonce of the other side. Every
+    agent builds one unit at a time. The artifacts an agent sends back are installed
+    locally, together with the build stamp the agent computed, and sent to the agents
+    that build something depending on them. An agent whose build has the stamp the
+    coordinator installed already sends nothing back.
+    """
+
+    def __init__(self, address: tuple, token: str, history: BuildHistory = None) -> None:
+        self._token = token
+        self._history = history
+        self._server = socket.create_server(address)
+        self._idle = queue.Queue()
+        self._agents = list()
+        self._artifacts = dict()
+        self._artifact_dir = tempfile.mkdtemp(prefix="czechlight-artifacts-")
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.info(f"Waiting for agents on port {self._server.getsockname()[1]}...")
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                return
+            connection = Connection(sock)
+            try:
+                sock.settimeout(HANDSHAKE_TIMEOUT)
+                hello = connection.receive()
+                if hello.get("type") != "hello" or hello.get("version") != PROTOCOL_VERSION:
+                    raise ValueError("unsupported protocol")
+                nonce = _nonce()
+                connection.send({"type": "welcome", "proof": _proof(self._token, hello["nonce"]), "nonce": nonce})
+                auth = connection.receive()
+                if not hmac.compare_digest(str(auth.get("proof")), _proof(self._token, nonce)):
+                    raise ValueError("wrong token")
+                sock.settimeout(None)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Rejected {address[0]}: {e}")
+                connection.close()
+                continue
+            agent = _Agent(hello["name"], connection)
+            self._agents.append(agent)
+            logger.info(f"Agent {agent.name} connected from {address[0]}")
+            self._idle.put(agent)
+
+    def close(self) -> None:
+        """Dismisses the agents and stops accepting new ones.
+
+        Returns:
+            None
+        """
+
+        self._server.close()
+        for agent in self._agents:
+            try:
+                agent.connection.send({"type": "exit"})
+            except OSError:
+                pass
+            agent.connection.close()
+        shutil.rmtree(self._artifact_dir, ignore_errors=True)
+
+    def build(self, unit: tuple, upstream: list, install_dir: str, build_dir: str, force: bool) -> None:
+        """Builds a unit on the next idle agent and installs its artifact.
+
+        A unit whose agent disconnects is handed to another agent. The unit fails when
+        no agent is connected for AGENT_TIMEOUT seconds.
+
+        Args:
+            unit (tuple): The (prefix, repository) unit.
+            upstream (list): The units this one depends on, directly or not.
+            install_dir (str): The local installation directory of the prefix.
+            build_dir (str): The local build directory of the repository.
+            force (bool): Whether to build even if the previous build on the agent is up to date.
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: If the build fails, its artifact is rejected or there are no agents.
+        """
+
+        while True:
+            agent = self._next_idle(unit)
+            try:
+                self._build_on(agent, unit, upstream, install_dir, build_dir, force)
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"Lost agent {agent.name} while building {'/'.join(unit)}: {e}")
+                self._agents.remove(agent)
+                agent.connection.close()
+                continue
+            except RuntimeError:
+                self._idle.put(agent)
+                raise
+            self._idle.put(agent)
+            return
+
+    def _next_idle(self, unit: tuple) -> _Agent:
+        deadline = None
+        while True:
+            try:
+                return self._idle.get(timeout=IDLE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            # The connected agents are all busy, their builds take as long as they take
+            if self._agents:
+                deadline = None
+                continue
+            if deadline is None:
+                logger.warning(f"No agents are connected, {'/'.join(unit)} waits up to {AGENT_TIMEOUT:.0f}s for one")
+                deadline = time.monotonic() + AGENT_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise RuntimeError(f"No agent connected within {AGENT_TIMEOUT:.0f}s to build {'/'.join(unit)}")
+
+    def _build_on(self, agent: _Agent, unit: tuple, upstream: list, install_dir: str, build_dir: str,
+                  force: bool) -> None:
+        prefix, repository = unit
+        for upstream_unit in upstream:
+            if upstream_unit in agent.installed or upstream_unit not in self._artifacts:
+                continue
+            artifact_file, metadata, stamp = self._artifacts[upstream_unit]
+            agent.connection.send({"type": "artifact", "prefix": upstream_unit[0], "repository": upstream_unit[1],
+                                   "metadata": metadata, "stamp": stamp}, artifact_file)
+            agent.installed.add(upstream_unit)
+
+        # The agent only sends the artifact back if it differs from the installed one
+        stamp_dir = os.path.join(os.path.dirname(build_dir), STAMP_DIR_NAME)
+        installed_stamp = read_stamp(stamp_dir, repository)
+        fingerprint = None
+        if not force and installed_stamp is not None and read_manifest(build_dir):
+            fingerprint = installed_stamp["fingerprint"]
+
+        logger.info(f"Building {prefix}/{repository} on {agent.name}...")
+        started = time.time()
+        agent.connection.send({"type": "build", "prefix": prefix, "repository": repository, "force": force,
+                               "fingerprint": fingerprint})
+        artifact_file = os.path.join(self._artifact_dir, f"{prefix}-{repository}.tar.gz")
+        while True:
+            message = agent.connection.receive(artifact_file)
+            if message["type"] == "log":
+                logger.log(message["level"], f"[{agent.name}] {message['text']}")
+            elif message["type"] == "done":
+                break
+        if not message["ok"]:
+            if self._history is not None:
+                self._history.record_phase(prefix, repository, "install", started, time.time() - started, False)
+            raise RuntimeError(f"{prefix}/{repository} failed on {agent.name}: {message['error']}")
+
+        stamp = message["stamp"]
+        if message.get("unchanged"):
+            # Downstream units built on other agents still need the installed files
+            metadata = pack_artifact(artifact_file, repository, install_dir, build_dir)
+            logger.info(f"{prefix}/{repository} built on {agent.name} is installed already")
+        else:
+            metadata = message["metadata"]
+            if metadata["prefix"] is not None:
+                logger.warning(f"{repository} from {agent.name} has {metadata['prefix']} compiled in, give the "
+                               f"agents the same directory layout as the coordinator")
+            try:
+                with open(artifact_file, "rb") as f:
+                    unpack_artifact(f, metadata, install_dir, build_dir)
+            except (OSError, ValueError, tarfile.TarError) as e:
+                if self._history is not None:
+                    self._history.record_phase(prefix, repository, "install", started, time.time() - started, False)
+                raise RuntimeError(f"Could not install {prefix}/{repository} built on {agent.name}: {e}") from e
+            if stamp is not None:
+                write_stamp(stamp_dir, repository, stamp)
+            if self._history is not None:
+                self._history.record_phase(prefix, repository, "install", started, time.time() - started, True)
+            logger.info(f"Installed {prefix}/{repository} built on {agent.name}")
+        self._artifacts[unit] = (artifact_file, metadata, stamp)
+        agent.installed.add(unit)
+
+
+class _ForwardingHandler(logging.Handler):
+    def __init__(self, connection: Connection) -> None:
+        super().__init__()
+        self.connection = connection
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.connection.send({"type": "log", "level": record.levelno, "text": record.getMessage()})
+        except OSError:
+            pass
+
+
+def run_agent(address: tuple, name: str, token: str, build_unit, unit_dirs) -> None:
+    """Connects to a coordinator and builds the units it hands out until it dismisses the agent.
+
+    The log records of every build are forwarded to the coordinator, the installed
+    files are sent back as an artifact.
+
+    Args:
+        address (tuple): The (host, port) address of the coordinator.
+        name (str): The name of the agent.
+        token (str): The secret shared with the coordinator.
+        build_unit (callable): Called with the (prefix, repository) unit and the force flag to build it.
+        unit_dirs (callable): Returns the (install_dir, build_dir) tuple of a (prefix, repository) unit.
+
+    Returns:
+        None
+
+    Raises:
+        ConnectionError: If the coordinator does not know the token.
+    """
+
+    sock = socket.create_connection(address, HANDSHAKE_TIMEOUT)
+    connection = Connection(sock)
+    nonce = _nonce()
+    connection.send({"type": "hello", "name": name, "version": PROTOCOL_VERSION, "nonce": nonce})
+    welcome = connection.receive()
+    if welcome.get("type") != "welcome" or not hmac.compare_digest(str(welcome.get("proof")), _proof(token, nonce)):
+        connection.close()
+        raise ConnectionError(f"{address[0]}:{address[1]} is not a coordinator with the same token")
+    connection.send({"type": "auth", "proof": _proof(token, welcome["nonce"])})
+    sock.settimeout(None)
+    logger.info(f"Connected to {address[0]}:{address[1]} as {name}")
+
+    with tempfile.TemporaryDirectory(prefix="czechlight-agent-") as tmp_dir:
+        artifact_file = os.path.join(tmp_dir, "artifact.tar.gz")
+        try:
+            while True:
+                message = connection.receive(artifact_file)
+                if message["type"] == "exit":
+                    break
+                unit = (message["prefix"], message["repository"])
+                install_dir, build_dir = unit_dirs(unit)
+                stamp_dir = os.path.join(os.path.dirname(build_dir), STAMP_DIR_NAME)
+
+                if message["type"] == "artifact":
+                    with open(artifact_file, "rb") as f:
+                        unpack_artifact(f, message["metadata"], install_dir, build_dir)
+                    if message["stamp"] is not None:
+                        write_stamp(stamp_dir, unit[1], message["stamp"])
+                    logger.info(f"Installed {'/'.join(unit)} built elsewhere")
+                    continue
+
+                handler = _ForwardingHandler(connection)
+                logging.getLogger().addHandler(handler)
+                try:
+                    build_unit(unit, message["force"])
+                    stamp = read_stamp(stamp_dir, unit[1])
+                    unchanged = stamp is not None and stamp["fingerprint"] == message["fingerprint"]
+                    if not unchanged:
+                        metadata = pack_artifact(artifact_file, unit[1], install_dir, build_dir)
+                except (Exception, SystemExit) as e:
+                    connection.send({"type": "done", "ok": False, "error": repr(e)})
+                    continue
+                finally:
+                    logging.getLogger().removeHandler(handler)
+                if unchanged:
+                    connection.send({"type": "done", "ok": True, "unchanged": True, "stamp": stamp})
+                else:
+                    connection.send({"type": "done", "ok": True, "metadata": metadata, "stamp": stamp}, artifact_file)
+        except ConnectionError:
+            logger.warning("The coordinator closed the connection")
+        finally:
+            connection.close()
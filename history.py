@@ -0,0 +1,396 @@
+import os
+import time
+import bisect
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILE_NAME = "history.sqlite"
+
+# The minimal slowdown of a phase reported as a regression, relative and in seconds
+REGRESSION_RATIO = 0.1
+REGRESSION_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    action TEXT NOT NULL,
+    target TEXT
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    prefix TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    succeeded INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    prefix TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    output TEXT NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    prefix TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    test TEXT NOT NULL,
+    duration REAL NOT NULL,
+    passed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memory (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    prefix TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    peak_rss INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS units (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    unit TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    PRIMARY KEY (run_id, unit)
+);
+CREATE INDEX IF NOT EXISTS memory_repository ON memory (prefix, repository, phase);
+CREATE INDEX IF NOT EXISTS tests_repository ON tests (prefix, repository, test);
+CREATE INDEX IF NOT EXISTS phases_repository ON phases (prefix, repository, phase);
+CREATE INDEX IF NOT EXISTS targets_run ON targets (run_id, prefix, repository);
+"""
+
+
+class BuildHistory:
+    """The timing history of all builds, stored in a local SQLite database.
+
+    The history can be shared by concurrently running builds.
+    """
+
+    def __init__(self, log_dir: str) -> None:
+        self.db_file = os.path.join(log_dir, HISTORY_FILE_NAME)
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def start_run(self, action: str, target: str) -> None:
+        """Starts a new run, the timings recorded from now on belong to it.
+
+        Args:
+            action (str): The performed action.
+            target (str): The target of the action.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self.run_id = self._db.execute("INSERT INTO runs (started, action, target) VALUES (?, ?, ?)",
+                                           (time.time(), action, target)).lastrowid
+
+    def record_phase(self, prefix: str, repository: str, phase: str, started: float, duration: float,
+                     succeeded: bool) -> None:
+        """Records the duration of one phase of a repository build.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            started (float): The time the phase started at.
+            duration (float): The duration of the phase in seconds.
+            succeeded (bool): Whether the phase succeeded.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (self.run_id, prefix, repository, phase, started, duration, int(succeeded)))
+
+    def record_targets(self, prefix: str, repository: str, targets: list) -> None:
+        """Records the build times of the Ninja targets of a repository build.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            targets (list): The (output, start_ms, end_ms) tuples from the Ninja log.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self._db.executemany("INSERT INTO targets VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(self.run_id, prefix, repository) + target for target in targets])
+
+    def record_peak_rss(self, prefix: str, repository: str, phase: str, peak_rss: int) -> None:
+        """Records the peak memory of the largest process of one phase of a repository build.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            peak_rss (int): The peak resident set size in bytes.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO memory VALUES (?, ?, ?, ?, ?)",
+                             (self.run_id, prefix, repository, phase, peak_rss))
+
+    def peak_rss(self, prefix: str, repository: str, phase: str, limit: int = 5) -> int:
+        """Returns the highest peak memory of the largest process of the last runs of a phase.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            limit (int, optional): The number of last runs to consider.
+
+        Returns:
+            int: The peak resident set size in bytes, None if the phase never ran.
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT MAX(peak_rss) FROM (SELECT peak_rss FROM memory "
+                                    "WHERE prefix = ? AND repository = ? AND phase = ? "
+                                    "ORDER BY rowid DESC LIMIT ?)", (prefix, repository, phase, limit)).fetchone()[0]
+
+    def record_unit(self, unit: str, status: str, error: str = None) -> None:
+        """Records the state of a unit of the current run in its journal.
+
+        Args:
+            unit (str): The name of the unit.
+            status (str): The state of the unit.
+            error (str, optional): Why the unit failed.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)", (self.run_id, unit, status, error))
+
+    def last_journal(self, action: str, target: str) -> dict:
+        """Returns the journal of the last earlier run of an action.
+
+        Args:
+            action (str): The performed action.
+            target (str): The target of the action.
+
+        Returns:
+            dict: The (status, error) tuples by unit, empty if there is no such run.
+        """
+
+        with self._lock:
+            rows = self._db.execute("SELECT unit, status, error FROM units WHERE run_id = "
+                                    "(SELECT MAX(runs.id) FROM runs JOIN units ON units.run_id = runs.id "
+                                    "WHERE action = ? AND target IS ? AND runs.id < ?)",
+                                    (action, target, self.run_id if self.run_id is not None else 2 ** 63 - 1))
+            return {unit: (status, error) for unit, status, error in rows}
+
+    def record_test(self, prefix: str, repository: str, test: str, duration: float, passed: bool) -> None:
+        """Records the result of one test.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            test (str): The name of the test.
+            duration (float): The duration of the test in seconds.
+            passed (bool): Whether the test passed.
+
+        Returns:
+            None
+        """
+
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?)",
+                             (self.run_id, prefix, repository, test, duration, int(passed)))
+
+    def test_durations(self, prefix: str, repository: str) -> dict:
+        """Returns the durations of the last runs of the tests of a repository.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+
+        Returns:
+            dict: The durations in seconds by test name.
+        """
+
+        with self._lock:
+            rows = self._db.execute("SELECT test, duration FROM tests WHERE prefix = ? AND repository = ? "
+                                    "ORDER BY run_id", (prefix, repository))
+            return dict(rows.fetchall())
+
+    def phase_durations(self, prefix: str, repository: str, phase: str, limit: int = 10) -> list:
+        """Lists the durations of the last successful runs of a phase.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            limit (int, optional): The maximal number of durations.
+
+        Returns:
+            list: The durations in seconds, the most recent first.
+        """
+
+        with self._lock:
+            rows = self._db.execute("SELECT duration FROM phases "
+                                    "WHERE prefix = ? AND repository = ? AND phase = ? AND succeeded "
+                                    "ORDER BY started DESC LIMIT ?", (prefix, repository, phase, limit))
+            return [duration for duration, in rows]
+
+    def last_phases(self) -> list:
+        """Lists the phases of every repository build that has been timed.
+
+        Returns:
+            list: The (prefix, repository, phase) tuples.
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT DISTINCT prefix, repository, phase FROM phases "
+                                    "ORDER BY prefix, repository, phase").fetchall()
+
+    def last_targets(self, prefix: str, repository: str) -> list:
+        """Lists the Ninja targets of the last timed build of a repository.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+
+        Returns:
+            list: The (output, start_ms, end_ms) tuples.
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT output, start_ms, end_ms FROM targets "
+                                    "WHERE prefix = ? AND repository = ? AND run_id = "
+                                    "(SELECT MAX(run_id) FROM targets WHERE prefix = ? AND repository = ?)",
+                                    (prefix, repository, prefix, repository)).fetchall()
+
+
+def ninja_log_size(build_dir: str) -> int:
+    """Returns the size of the Ninja log of a build directory (0 if there is none)."""
+    try:
+        return os.path.getsize(os.path.join(build_dir, ".ninja_log"))
+    except OSError:
+        return 0
+
+
+def read_ninja_log(build_dir: str, offset: int = 0) -> list:
+    """Reads the targets built by Ninja from its log.
+
+    Args:
+        build_dir (str): The build directory.
+        offset (int, optional): The size of the log before the build, only the entries
+            appended since are read. Ignored if the log was rewritten in the meantime.
+
+    Returns:
+        list: The (output, start_ms, end_ms) tuples.
+    """
+
+    log_file = os.path.join(build_dir, ".ninja_log")
+    if not os.path.exists(log_file):
+        return list()
+
+    with open(log_file, 'r', errors="replace") as f:
+        if offset <= os.path.getsize(log_file):
+            f.seek(offset)
+        targets = dict()
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                continue
+            start_ms, end_ms, _, output = fields[:4]
+            targets[output] = (output, int(start_ms), int(end_ms))
+    return list(targets.values())
+
+
+def critical_path(targets: list) -> list:
+    """Estimates the critical path of a build from its timeline.
+
+    The Ninja log does not record dependencies, so every step is assumed to have waited
+    for the step that finished last before it started.
+
+    Args:
+        targets (list): The (output, start_ms, end_ms) tuples.
+
+    Returns:
+        list: The targets on the path, in build order.
+    """
+
+    by_end = sorted(targets, key=lambda target: target[2])
+    ends = [end for _, _, end in by_end]
+    path = list()
+    index = len(by_end) - 1
+    while index >= 0:
+        path.append(by_end[index])
+        index = bisect.bisect_right(ends, by_end[index][1], 0, index) - 1
+    return list(reversed(path))
+
+
+def report(history: BuildHistory, repositories: list = None, top: int = 10) -> None:
+    """Logs the trends of the phase durations, the regressions and the most expensive targets.
+
+    Args:
+        history (BuildHistory): The build history.
+        repositories (list, optional): The repositories to report on, all by default.
+        top (int, optional): The number of the most expensive translation units to show.
+
+    Returns:
+        None
+    """
+
+    translation_units = list()
+    regressions = list()
+    for prefix, repository, phase in history.last_phases():
+        if repositories is not None and repository not in repositories:
+            continue
+        durations = history.phase_durations(prefix, repository, phase)
+        if not durations:
+            continue
+        trend = " ".join(f"{duration:.1f}" for duration in reversed(durations))
+        line = f"{prefix}/{repository} {phase}: {durations[0]:.1f}s (trend: {trend})"
+        if len(durations) > 1:
+            change = durations[0] - durations[1]
+            line += f", {change:+.1f}s against the previous run"
+            if change > REGRESSION_SECONDS and change > REGRESSION_RATIO * durations[1]:
+                regressions.append(f"{prefix}/{repository} {phase}: {durations[1]:.1f}s -> {durations[0]:.1f}s")
+        logger.info(line)
+
+        if phase == "install":
+            targets = history.last_targets(prefix, repository)
+            path = critical_path(targets)
+            if path:
+                steps = ", ".join(f"{os.path.basename(output)} ({(end - start) / 1000:.1f}s)"
+                                  for output, start, end in sorted(path, key=lambda t: t[1] - t[2])[:3])
+                logger.info(f"  critical path: {len(path)} steps, {(path[-1][2] - path[0][1]) / 1000:.1f}s, "
+                            f"longest: {steps}")
+            translation_units += [(end - start, prefix, repository, output)
+                                  for output, start, end in targets if output.endswith(".o")]
+
+    if regressions:
+        logger.warning("Regressions against the previous run:")
+        for regression in regressions:
+            logger.warning(f"  {regression}")
+
+    if translation_units:
+        logger.info(f"The {top} most expensive translation units:")
+        for duration_ms, prefix, repository, output in sorted(translation_units, reverse=True)[:top]:
+            logger.info(f"  {duration_ms / 1000:8.1f}s {prefix}/{repository} {output}")
@@ -0,0 +1,101 @@
+import logging
+
+from history import BuildHistory
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def unit_name(unit) -> str:
+    """Returns the name of a unit in the journal.
+
+    Args:
+        unit (tuple or str): The (prefix, repository) unit or the repository name.
+
+    Returns:
+        str: The name.
+    """
+
+    return "/".join(unit) if isinstance(unit, tuple) else unit
+
+
+class RunJournal:
+    """The state of every unit of a run, kept in the build history.
+
+    The run has to be started in the history already. A run that stopped on a failure
+    can be resumed by a later run of the same action and target, which skips the units
+    that completed.
+    """
+
+    def __init__(self, history: BuildHistory, graph: dict, action: str, target: str, resume: bool = False) -> None:
+        self.history = history
+        self.graph = graph
+        self.completed = set()
+        self.errors = dict()
+
+        if resume:
+            previous = history.last_journal(action, target)
+            if not previous:
+                logger.warning(f"There is no earlier {action} of {target} to resume")
+            self.completed = {unit for unit in graph if previous.get(unit_name(unit), (None,))[0] == COMPLETED}
+            if self.completed:
+                logger.info(f"Resuming without the {len(self.completed)} units completed by the last {action}")
+        for unit in graph:
+            self.history.record_unit(unit_name(unit), COMPLETED if unit in self.completed else PENDING)
+
+    def remaining(self) -> dict:
+        """Returns the part of the graph that is left to run.
+
+        Returns:
+            dict: A mapping of each unit that did not complete to the set of such units it depends on.
+        """
+
+        return {unit: dependencies - self.completed for unit, dependencies in self.graph.items()
+                if unit not in self.completed}
+
+    def wrap(self, run_unit):
+        """Wraps the function running a unit to record its result.
+
+        Args:
+            run_unit (callable): Called with the unit to run it.
+
+        Returns:
+            callable: The wrapped function.
+        """
+
+        def run(unit):
+            try:
+                run_unit(unit)
+            except BaseException as e:
+                error = str(e) or repr(e)
+                self.errors[unit] = error
+                self.history.record_unit(unit_name(unit), FAILED, error)
+                raise
+            self.completed.add(unit)
+            self.history.record_unit(unit_name(unit), COMPLETED)
+
+        return run
+
+    def summarize(self, action: str) -> bool:
+        """Logs the failed units and the units that did not run because of them.
+
+        Args:
+            action (str): The name of the action for the messages.
+
+        Returns:
+            bool: Whether every unit completed.
+        """
+
+        if len(self.completed) == len(self.graph):
+            return True
+        for unit, error in self.errors.items():
+            logger.error(f"Failed to {action} {unit_name(unit)}: {error}")
+        blocked = [unit_name(unit) for unit in self.graph if unit not in self.completed and unit not in self.errors]
+        if blocked:
+            logger.error(f"Did not {action} {len(blocked)} units: {', '.join(sorted(blocked))}")
+        logger.error(f"{len(self.errors)} failed, {len(blocked)} not run, {len(self.completed)} of "
+                     f"{len(self.graph)} completed, continue with --resume once fixed")
+        return False
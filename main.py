@@ -1,16 +1,59 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import glob
+import json
+import time
 import yaml
 import shutil
+import signal
+import socket
+import tempfile
+import contextlib
+import subprocess
 import argparse
 import logging.config
 
-from utils import install, clean, load_env
+from cache import ArtifactCache, read_manifest
+from cmakecache import ProbeCache
+from distributed import TOKEN_VARIABLE, Coordinator, parse_address, run_agent
+from history import BuildHistory, report
+from watch import watch
+from dedup import STORE_DIR_NAME, dedup
+from progress import ProgressTracker
+from journal import RunJournal
+from rambuild import DEFAULT_RAM_DIR, RamBuildDirs
+from testrunner import run_tests, write_reports
+from serverpool import SERVER_COMMAND, ServerPool, acquire_server
+from netconfbench import STAND_IN_COMMAND, log_results, run_load
+from trash import TRASH_DIR_NAME, move_to_trash, start_reaper
+from utils import install, link_shared, uninstall, clean, load_env, download_dependency, update_dependency
+from admission import AdmissionController
+from scheduler import dependency_graph, downstream, expand_graph, run_graph, share_units, topological_order, upstream
+from stamps import LAST_BUILD, STAMP_DIR_NAME, changed_since, read_stamp
 
 CZECHLIGHT_DIR = "/home/ales/cesnet/czechlight/"
 
+COMPILERS = ["gcc", "clang"]
 
+# Sanitizer choices and the names of their prefixes
+SANITIZERS = {"none": "clean", "thread": "tsan", "address": "asan"}
+
+# The build profile whose prefix directories are not suffixed with its name
+DEFAULT_PROFILE = "debug"
+
+# The prefix the repositories shared by all prefixes are built in, and the prefix of the per-compiler ones
+SHARED_PREFIX = "shared"
+
+# The number of netopeer2-server instances started by the serve action by default
+DEFAULT_SERVERS = 4
+
+# The default size limit of the artifact cache in GiB
+CACHE_SIZE = 20
+
+# The number of repositories fetched at once
+DOWNLOAD_WORKERS = 8
 
 
 def main():
@@ -22,6 +65,8 @@ def main():
     logging_config = os.path.join(root_dir, "config", "logging.yaml")
     dependency_config = os.path.join(root_dir, "config", "dependencies.yaml")
     netconf_cli_config = os.path.join(root_dir, "config", "netconf-cli.yaml")
+    profile_config = os.path.join(root_dir, "config", "profiles.yaml")
+    netconf_bench_config = os.path.join(root_dir, "config", "netconf-bench.yaml")
 
     # Load the dependency configuration
     with open(dependency_config, 'r') as f:
@@ -32,6 +77,27 @@ def main():
     with open(netconf_cli_config, 'r') as f:
         netconf_cli = yaml.safe_load(f.read())
 
+    # Load the build profiles
+    with open(profile_config, 'r') as f:
+        profiles = yaml.safe_load(f.read())
+
+    # Load the RPC mixes of bench-netconf
+    with open(netconf_bench_config, 'r') as f:
+        netconf_mixes = yaml.safe_load(f.read())
+
+    repositories = dict(dependencies)
+    repositories["netconf-cli"] = netconf_cli
+
+    # Shared repositories are built outside of the prefixes, so everything they depend on has to be shared alike
+    for name, data in repositories.items():
+        shared_by = data.get("shared_by")
+        if shared_by not in (None, "compiler", "all"):
+            raise ValueError(f"Unknown shared_by of {name}: {shared_by}")
+        unshared = [dependency for dependency in data.get("depends_on") or list()
+                    if shared_by is not None and repositories.get(dependency, dict()).get("shared_by") != shared_by]
+        if unshared:
+            raise ValueError(f"Dependencies of {name} not shared by {shared_by}: {', '.join(unshared)}")
+
     with open(logging_config, 'r') as f:
         config = yaml.safe_load(f.read())
 
@@ -43,33 +109,150 @@ def main():
     # ------------------------------------------------
 
     arg_parser = argparse.ArgumentParser(description="Utility for downloading and building dependencies")
-    arg_parser.add_argument("-a", "--action", type=str, choices=["install", "clean"],
+    arg_parser.add_argument("-a", "--action", type=str,
+                            choices=["download", "update", "install", "watch", "test", "serve", "cli", "bench-netconf",
+                                     "clean", "cache", "report", "dedup", "agent"],
                             help="Action to perform")
+    arg_parser.add_argument("cache_command", type=str, nargs="?", choices=["stats", "prune"],
+                            help="The cache action to perform: show the cached artifacts or evict them down "
+                                 "to the size limit")
     arg_parser.add_argument("-t", "--target", type=str,
                             choices=["all", "dependencies", "netconf-cli"] + dependency_names,
                             help="The target to perform the action on")
-    arg_parser.add_argument("-c", "--compiler", type=str, choices=["gcc", "clang"], default="gcc",
+    arg_parser.add_argument("-c", "--compiler", type=str, choices=COMPILERS, default="gcc",
                             help="The compiler to use")
-    arg_parser.add_argument("-s", "--sanitizer", type=str, choices=["none", "address", "thread"],
-                            default="none", help="The sanitizer to use")
-    arg_parser.add_argument("-j", "--jobs", type=int, default=1, help="The number of jobs to use")
+    arg_parser.add_argument("-s", "--sanitizer", type=str, choices=list(SANITIZERS), default="none",
+                            help="The sanitizer to use")
+    arg_parser.add_argument("-p", "--profile", type=str, choices=list(profiles), default=DEFAULT_PROFILE,
+                            help="The build profile from config/profiles.yaml to use")
+    arg_parser.add_argument("-m", "--matrix", type=str, nargs="?", const="", metavar="FILTER",
+                            help="Perform the action on every compiler-sanitizer prefix matching the regex FILTER "
+                                 "(all prefixes if omitted) instead of a single one")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                            help="The number of jobs shared by all concurrently running builds, or the number "
+                                 "of tests running at once")
+    arg_parser.add_argument("--memory-limit", type=float, metavar="GIB",
+                            help="The memory use in GiB above which builds get fewer jobs (90%% of the physical "
+                                 "memory by default)")
+    arg_parser.add_argument("-f", "--force", action="store_true",
+                            help="Rebuild the targets even if they are up to date")
+    arg_parser.add_argument("--changed-since", type=str, metavar="REF",
+                            help=f"Only install the targets with new commits since the Git reference REF (or since "
+                                 f"their last successful build with '{LAST_BUILD}') or uncommitted changes, "
+                                 f"together with everything that depends on them")
+    arg_parser.add_argument("--clean-shared", action="store_true",
+                            help="Let clean remove the shared builds of sanitizer-agnostic repositories even "
+                                 "when prefixes that are not selected link to them")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="Neither install from nor store into the artifact cache")
+    arg_parser.add_argument("--cache-size", type=float, default=CACHE_SIZE,
+                            help="The size limit of the artifact cache in GiB")
+    arg_parser.add_argument("--no-probe-cache", action="store_true",
+                            help="Run every configure check in every repository instead of taking the results "
+                                 "known for the toolchain")
+    arg_parser.add_argument("--ram-build", type=float, metavar="GIB",
+                            help="Keep the most recently used build directories in RAM, using at most GIB of it")
+    arg_parser.add_argument("--ram-dir", type=str, default=DEFAULT_RAM_DIR,
+                            help="The tmpfs directory the build directories are kept in with --ram-build")
+    arg_parser.add_argument("--top", type=int, default=10,
+                            help="The number of the most expensive translation units to report")
+    arg_parser.add_argument("--servers", type=int, metavar="N",
+                            help=f"The number of netopeer2-server instances started by serve (default "
+                                 f"{DEFAULT_SERVERS}) or started for test, which gives every test a free one")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="Skip the units completed by the last download, update or install of the target")
+    arg_parser.add_argument("-k", "--keep-going", action="store_true",
+                            help="Keep running the units that do not depend on a failed one")
+    arg_parser.add_argument("--events", type=str, metavar="FILE",
+                            help="Append the progress of the builds to FILE as JSON lines")
+    arg_parser.add_argument("--mix", type=str, choices=list(netconf_mixes), default="default",
+                            help="The RPC mix from config/netconf-bench.yaml replayed by bench-netconf")
+    arg_parser.add_argument("--sessions", type=int, default=16,
+                            help="The number of concurrent NETCONF sessions of bench-netconf")
+    arg_parser.add_argument("--duration", type=float, default=10.0, metavar="SECONDS",
+                            help="The duration of the bench-netconf load on every prefix")
+    arg_parser.add_argument("--stand-in", action="store_true",
+                            help="Run bench-netconf against the bundled stand-in NETCONF server instead of "
+                                 "netopeer2-server")
+    arg_parser.add_argument("-d", "--dir", type=str, default=CZECHLIGHT_DIR,
+                            help="The CzechLight directory with the sources, builds and installations")
+    arg_parser.add_argument("--listen", type=str, metavar="[HOST:]PORT",
+                            help=f"Install by handing the builds to agents connecting to this address (localhost "
+                                 f"unless HOST is given), authenticated by the secret in ${TOKEN_VARIABLE}")
+    arg_parser.add_argument("--coordinator", type=str, metavar="HOST:PORT",
+                            help="The address of the coordinator the agent builds for")
     args = arg_parser.parse_args()
 
     # ------------------------------------------------
     # ================ DIRECTORY SETUP ===============
     # ------------------------------------------------
 
-    compiler = args.compiler
-    sanitizer = "clean" if args.sanitizer == "none" else args.sanitizer
-    build_options = f"{compiler}-{sanitizer}"
+    if args.matrix is not None:
+        try:
+            prefix_filter = re.compile(args.matrix)
+        except re.error as e:
+            arg_parser.error(f"Invalid matrix filter: {e}")
+        prefixes = [(compiler, sanitizer, args.profile) for compiler in COMPILERS for sanitizer in SANITIZERS.values()
+                    if prefix_filter.search(f"{compiler}-{sanitizer}")]
+        if not prefixes:
+            arg_parser.error(f"No prefix matches the matrix filter {args.matrix!r}.")
+    elif args.action == "agent":
+        # Agents build whatever prefix the coordinator asks for
+        prefixes = [(compiler, sanitizer, profile) for compiler in COMPILERS for sanitizer in SANITIZERS.values()
+                    for profile in profiles]
+    else:
+        prefixes = [(args.compiler, SANITIZERS[args.sanitizer], args.profile)]
+
+    czechlight_dir = os.path.abspath(args.dir)
+    log_dir = os.path.join(czechlight_dir, "logs")
+    cache_dir = os.path.join(czechlight_dir, "cache")
+    probe_dir = os.path.join(czechlight_dir, "configure-checks")
+    mirror_dir = os.path.join(czechlight_dir, "mirrors")
+    dependency_dir = os.path.join(czechlight_dir, "dependencies")
+    trash_dir = os.path.join(czechlight_dir, TRASH_DIR_NAME)
+
+    def prefix_name(compiler, sanitizer, profile):
+        build_options = f"{compiler}-{sanitizer}"
+        return build_options if profile == DEFAULT_PROFILE else f"{build_options}-{profile}"
 
-    log_dir = os.path.join(CZECHLIGHT_DIR, "logs")
-    dependency_dir = os.path.join(CZECHLIGHT_DIR, "dependencies")
-    build_dir = os.path.join(CZECHLIGHT_DIR, "build", build_options)
-    install_dir = os.path.join(CZECHLIGHT_DIR, "install", build_options)
+    def shared_prefix_of(name, compiler, profile):
+        # The prefix a sanitizer-agnostic repository is built in and its toolchain, None for the other ones
+        if repositories[name].get("shared_by") == "compiler":
+            return prefix_name(SHARED_PREFIX, compiler, profile), (compiler, "clean", profile)
+        if repositories[name].get("shared_by") == "all":
+            return SHARED_PREFIX, (COMPILERS[0], "clean", DEFAULT_PROFILE)
+        return None, None
+
+    # The selected prefixes and the shared prefixes their sanitizer-agnostic repositories are linked from
+    selected_prefixes = list()
+    prefix_toolchains = dict()
+    shared_units = dict()
+    for compiler, sanitizer, profile in prefixes:
+        build_options = prefix_name(compiler, sanitizer, profile)
+        selected_prefixes.append(build_options)
+        prefix_toolchains[build_options] = (compiler, sanitizer, profile)
+        for name in repositories:
+            shared_prefix, toolchain = shared_prefix_of(name, compiler, profile)
+            if shared_prefix is not None:
+                prefix_toolchains[shared_prefix] = toolchain
+                shared_units[(build_options, name)] = (shared_prefix, name)
+
+    log_dirs = dict()
+    build_dirs = dict()
+    install_dirs = dict()
+    server_dirs = dict()
+    bench_server_dirs = dict()
+    prefix_profiles = dict()
+    for build_options, (compiler, sanitizer, profile) in prefix_toolchains.items():
+        prefix_profiles[build_options] = profiles[profile]
+        log_dirs[build_options] = os.path.join(log_dir, build_options)
+        build_dirs[build_options] = os.path.join(czechlight_dir, "build", build_options)
+        install_dirs[build_options] = os.path.join(czechlight_dir, "install", build_options)
+        server_dirs[build_options] = os.path.join(install_dirs[build_options], "run", "servers")
+        bench_server_dirs[build_options] = os.path.join(install_dirs[build_options], "run", "bench")
 
     # Create the required directories
-    required_dirs = [log_dir, dependency_dir, build_dir, install_dir]
+    required_dirs = [log_dir, dependency_dir] + list(build_dirs.values()) + list(install_dirs.values())
     for directory in required_dirs:
         if not os.path.exists(directory):
             os.makedirs(directory)
@@ -78,51 +261,289 @@ def main():
     # ================ ENVIRONMENT ===================
     # ------------------------------------------------
 
-    env = load_env(args.compiler, args.sanitizer, install_dir)
+    envs = dict()
+    for build_options, (compiler, sanitizer, _) in prefix_toolchains.items():
+        profile = prefix_profiles[build_options]
+        envs[build_options] = load_env(compiler, sanitizer, install_dirs[build_options], profile["cflags"],
+                                       profile["ldflags"])
 
     # ------------------------------------------------
     # ================ MAIN LOGIC ====================
     # ------------------------------------------------
 
-    if args.action == "clean":
-        if args.target == "all":
-            for name, data in dependencies.items():
-                clean(name, dependency_dir, build_dir)
-            clean("netconf-cli", CZECHLIGHT_DIR, build_dir)
+    # Finish deleting what earlier cleans moved into the trash
+    if args.action != "clean":
+        start_reaper(trash_dir)
 
-            # Remove the contents of the installation directory
-            if os.path.exists(install_dir):
-                logger.info(f"Removing from {install_dir}...")
-                shutil.rmtree(install_dir)
-                os.makedirs(install_dir)
-        elif args.target == "dependencies":
-            for name, data in dependencies.items():
-                clean(name, dependency_dir, build_dir)
-        elif args.target in dependency_names:
-            clean(args.target, dependency_dir, build_dir)
-        elif args.target == "netconf-cli":
-            clean("netconf-cli", CZECHLIGHT_DIR, build_dir)
+    cache = None if args.no_cache else ArtifactCache(cache_dir, int(args.cache_size * 2 ** 30))
+
+    if args.action == "cache":
+        if cache is None:
+            arg_parser.error("The cache action can not be combined with --no-cache.")
+        if args.cache_command == "prune":
+            evicted = cache.prune()
+            logger.info(f"Evicted {len(evicted)} artifacts ({sum(e['size'] for e in evicted) / 2 ** 20:.1f} MiB)")
         else:
-            arg_parser.error("Invalid clean target.")
-
-    elif args.action == "install":
-        if args.target == "all":
-            for name, data in dependencies.items():
-                install(name, dependency_dir, build_dir, install_dir, env, data["build_args"], args.jobs)
-            install("netconf-cli", CZECHLIGHT_DIR, build_dir, install_dir, env, netconf_cli["build_args"],
-                    args.jobs)
-        elif args.target == "dependencies":
-            for name, data in dependencies.items():
-                install(name, dependency_dir, build_dir, install_dir, env, data["build_args"], args.jobs)
-        elif args.target in dependency_names:
-            install(args.target, dependency_dir, build_dir, install_dir, env,
-                    dependencies[args.target]["build_args"],
-                    args.jobs)
-        elif args.target == "netconf-cli":
-            install("netconf-cli", CZECHLIGHT_DIR, build_dir, install_dir, env, netconf_cli["build_args"],
-                    args.jobs)
+            stats = cache.stats()
+            for entry in stats["entries"]:
+                logger.info(f"{entry['key'][:12]} {entry['repository']:<16} {entry['size'] / 2 ** 20:8.1f} MiB "
+                            f"last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))}")
+            logger.info(f"{stats['artifacts']} artifacts, {stats['size'] / 2 ** 20:.1f} MiB "
+                        f"of {stats['max_size'] / 2 ** 20:.1f} MiB")
+        return
+
+    history = BuildHistory(log_dir)
+
+    if args.action == "report":
+        report(history, [args.target] if args.target in repositories else None, args.top)
+        return
+
+    if args.action == "dedup":
+        files = [path for build_dir in glob.glob(os.path.join(czechlight_dir, "build", "*", "*"))
+                 for path in read_manifest(build_dir)]
+        dedup(files, os.path.join(czechlight_dir, STORE_DIR_NAME))
+        return
+
+    if args.action == "serve":
+        with contextlib.ExitStack() as stack:
+            for build_options in selected_prefixes:
+                stack.enter_context(ServerPool(server_dirs[build_options], envs[build_options],
+                                               args.servers or DEFAULT_SERVERS))
+            logger.info("Serving until interrupted...")
+            try:
+                signal.pause()
+            except KeyboardInterrupt:
+                logger.info("Stopping the servers")
+        return
+
+    if args.action == "cli":
+        build_options = selected_prefixes[0]
+        try:
+            with acquire_server(server_dirs[build_options], timeout=0) as server:
+                logger.info(f"Connecting to {server['socket']}")
+                process = subprocess.run(["netconf-cli", "--socket", server["socket"]],
+                                         env=dict(envs[build_options], **server["env"]))
+        except TimeoutError:
+            logger.error(f"No free netopeer2-server of {build_options}, start them with the serve action")
+            exit(1)
+        exit(process.returncode)
+
+    if args.action == "bench-netconf":
+        results = dict()
+        for build_options in selected_prefixes:
+            with contextlib.ExitStack() as stack:
+                server = None
+                if not args.stand_in:
+                    with contextlib.suppress(TimeoutError):
+                        server = stack.enter_context(acquire_server(server_dirs[build_options], timeout=0))
+                if server is None:
+                    # Without a free server of the serve action, start one just for the benchmark
+                    command = STAND_IN_COMMAND if args.stand_in else (SERVER_COMMAND,)
+                    stack.enter_context(ServerPool(bench_server_dirs[build_options], envs[build_options], 1,
+                                                   command))
+                    server = stack.enter_context(acquire_server(bench_server_dirs[build_options], timeout=0))
+                logger.info(f"Benchmarking {build_options} on {server['socket']} with {args.sessions} sessions "
+                            f"for {args.duration}s...")
+                results[build_options] = dict(run_load(server["socket"], netconf_mixes[args.mix], args.sessions,
+                                                       args.duration), mix=args.mix, sessions=args.sessions)
+        log_results(results)
+
+        results_file = os.path.join(log_dir, "netconf-bench.json")
+        with open(results_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote {results_file}")
+        return
+
+    if args.target == "all" or args.action == "agent":
+        targets = dependency_names + ["netconf-cli"]
+    elif args.target == "dependencies":
+        targets = dependency_names
+    elif args.target in dependency_names or args.target == "netconf-cli":
+        targets = [args.target]
+    else:
+        arg_parser.error("Invalid target.")
+
+    if args.action in ("download", "update"):
+        if "netconf-cli" in targets:
+            if args.target == "netconf-cli":
+                arg_parser.error("The netconf-cli checkout is not managed by this tool.")
+            targets.remove("netconf-cli")
+
+        fetch = download_dependency if args.action == "download" else update_dependency
+
+        def fetch_dependency(name):
+            data = dependencies[name]
+            fetch(data["url"], name, data["branch"], data.get("commit"), dependency_dir, log_dir, mirror_dir)
+
+        history.start_run(args.action, args.target)
+        journal = RunJournal(history, {name: set() for name in targets}, args.action, args.target, args.resume)
+        run_graph(journal.remaining(), journal.wrap(fetch_dependency), max_workers=DOWNLOAD_WORKERS,
+                  keep_going=args.keep_going)
+        if not journal.summarize(args.action):
+            exit(1)
+
+    elif args.action == "test":
+        suites = [(build_options, name, os.path.join(build_dirs[build_options], name), envs[build_options])
+                  for build_options in selected_prefixes for name in targets
+                  if os.path.isdir(os.path.join(build_dirs[build_options], name))]
+        history.start_run(args.action, args.target)
+        state_dir = tempfile.mkdtemp(prefix="czechlight-tests-")
+        try:
+            with contextlib.ExitStack() as stack:
+                if args.servers:
+                    for build_options in selected_prefixes:
+                        stack.enter_context(ServerPool(server_dirs[build_options], envs[build_options], args.servers))
+                results = run_tests(suites, args.jobs, state_dir, history, server_dirs if args.servers else None)
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+        write_reports(results, log_dir)
+
+        failed = [result for result in results if not result["passed"]]
+        if failed:
+            names = [f"{result['prefix']}/{result['repository']} {result['test']}" for result in failed]
+            logger.error(f"{len(failed)} of {len(results)} tests failed: {', '.join(names)}")
+            exit(1)
+        logger.info(f"All {len(results)} tests passed")
+
+    elif args.action == "clean":
+        # Keep the files that are installed by the repositories which are not cleaned too
+        kept_files = dict()
+        for build_options, build_dir in build_dirs.items():
+            kept_files[build_options] = {path for name in repositories if name not in targets
+                                         for path in read_manifest(os.path.join(build_dir, name))}
+
+        # Nothing is kept when every repository is cleaned, the installation directories go away at once
+        uninstall_all = set(targets) == set(repositories)
+        if uninstall_all:
+            for install_dir in (install_dirs[build_options] for build_options in selected_prefixes):
+                move_to_trash(install_dir, trash_dir)
+                os.makedirs(install_dir)
+                logger.info(f"Removed {install_dir}")
+
+        def uninstall_repository(unit):
+            build_options, name = unit
+            if not uninstall_all or build_options not in selected_prefixes:
+                uninstall(name, build_dirs[build_options], install_dirs[build_options], kept_files[build_options])
+            clean(name, build_dirs[build_options], log_dirs[build_options], trash_dir)
+
+        # A prefix only drops its links to a shared build, which is cleaned once no prefix sharing it is left
+        units = expand_graph({name: set() for name in targets}, selected_prefixes)
+        for unit, (shared_prefix, name) in shared_units.items():
+            sharing = {prefix_name(compiler, sanitizer, profile) for compiler in COMPILERS
+                       for sanitizer in SANITIZERS.values() for profile in profiles
+                       if shared_prefix_of(name, compiler, profile)[0] == shared_prefix}
+            if unit in units and (args.clean_shared or sharing <= set(selected_prefixes)):
+                units[(shared_prefix, name)] = set()
+        failed = run_graph(units, uninstall_repository)
+        start_reaper(trash_dir)
+        if failed:
+            for unit, error in failed.items():
+                logger.error(f"Failed to clean {'/'.join(unit)}: {str(error) or repr(error)}")
+            exit(1)
+
+    elif args.action in ("install", "watch", "agent"):
+        memory_limit = None if args.memory_limit is None else int(args.memory_limit * 2 ** 30)
+        budget = AdmissionController(args.jobs, memory_limit)
+        graph = dependency_graph(repositories, targets)
+        progress = ProgressTracker(history, args.events)
+        probes = None if args.no_probe_cache else ProbeCache(probe_dir, [czechlight_dir])
+        ram = None if args.ram_build is None else RamBuildDirs(int(args.ram_build * 2 ** 30), args.ram_dir, trash_dir)
+
+        def source_dir(name):
+            return czechlight_dir if name == "netconf-cli" else dependency_dir
+
+        def build(unit, force=args.force):
+            build_options, name = unit
+            try:
+                if unit in shared_units:
+                    shared_prefix = shared_units[unit][0]
+                    link_shared(name, build_dirs[shared_prefix], install_dirs[shared_prefix],
+                                build_dirs[build_options], install_dirs[build_options], force)
+                    return
+                profile = prefix_profiles[build_options]
+                install(name, source_dir(name), build_dirs[build_options], install_dirs[build_options],
+                        envs[build_options], repositories[name]["build_args"] + profile["cmake_args"], budget=budget,
+                        upstream=repositories[name].get("depends_on", []), force=force, cache=cache,
+                        log_dir=log_dirs[build_options], history=history, build_type=profile["build_type"],
+                        progress=progress, ram=ram, probes=probes)
+            finally:
+                progress.unit_finished(unit)
+
+        if args.action == "agent":
+            if args.coordinator is None:
+                arg_parser.error("The agent action requires --coordinator.")
+            if not os.environ.get(TOKEN_VARIABLE):
+                arg_parser.error(f"The agent action requires the secret shared with the coordinator in "
+                                 f"${TOKEN_VARIABLE}.")
+            history.start_run(args.action, args.coordinator)
+            try:
+                run_agent(parse_address(args.coordinator), f"{socket.gethostname()}-{os.getpid()}",
+                          os.environ[TOKEN_VARIABLE], build,
+                          lambda unit: (install_dirs[unit[0]], os.path.join(build_dirs[unit[0]], unit[1])))
+            except ConnectionError as e:
+                logger.error(e)
+                exit(1)
+            finally:
+                progress.close()
+
+        elif args.action == "install":
+            units = share_units(expand_graph(graph, selected_prefixes), shared_units)
+            if args.changed_since is not None:
+                changed = {(build_options, name) for build_options, name in units
+                           if changed_since(os.path.join(source_dir(name), name), args.changed_since,
+                                            read_stamp(os.path.join(build_dirs[build_options], STAMP_DIR_NAME), name))}
+                affected = downstream(units, changed)
+                units = {unit: units[unit] & affected for unit in affected}
+                if not units:
+                    logger.info(f"Nothing changed since {args.changed_since}")
+                    return
+                logger.info(f"Installing {', '.join('/'.join(unit) for unit in topological_order(units))}")
+
+            history.start_run(args.action, args.target)
+            journal = RunJournal(history, units, args.action, args.target, args.resume)
+            progress.plan(list(journal.remaining()))
+            if args.listen is None:
+                run_graph(journal.remaining(), journal.wrap(build), budget, keep_going=args.keep_going)
+            else:
+                if not os.environ.get(TOKEN_VARIABLE):
+                    arg_parser.error(f"--listen requires a secret shared with the agents in ${TOKEN_VARIABLE}.")
+                coordinator = Coordinator(parse_address(args.listen), os.environ[TOKEN_VARIABLE], history)
+
+                def build_remotely(unit):
+                    build_options, name = unit
+                    try:
+                        coordinator.build(unit, upstream(units, {unit}) - {unit}, install_dirs[build_options],
+                                          os.path.join(build_dirs[build_options], name), args.force)
+                    finally:
+                        progress.unit_finished(unit)
+
+                try:
+                    run_graph(journal.remaining(), journal.wrap(build_remotely), keep_going=args.keep_going)
+                finally:
+                    coordinator.close()
+            progress.close()
+            if not journal.summarize(args.action):
+                exit(1)
         else:
-            arg_parser.error("Invalid build target.")
+            def rebuild(changed):
+                # Rebuild the changed repositories and everything that consumes them
+                affected = downstream(graph, changed)
+                history.start_run(args.action, ",".join(sorted(changed)))
+                units = share_units(expand_graph({name: graph[name] & affected for name in affected},
+                                                 selected_prefixes), shared_units)
+                progress.plan(list(units))
+                failed = run_graph(units, build, budget, keep_going=args.keep_going)
+                if failed:
+                    for unit, error in failed.items():
+                        logger.error(f"Failed to install {'/'.join(unit)}: {str(error) or repr(error)}")
+                else:
+                    logger.info(f"Installed {', '.join(sorted(affected))}")
+
+            try:
+                watch({name: os.path.join(source_dir(name), name) for name in targets}, rebuild)
+            except KeyboardInterrupt:
+                logger.info("Stopped watching")
+            progress.close()
 
 
 if __name__ == "__main__":
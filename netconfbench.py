@@ -0,0 +1,306 @@
+import os
+import sys
+import math
+import time
+import random
+import asyncio
+import argparse
+import logging
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+BASE_NAMESPACE = "urn:ietf:params:xml:ns:netconf:base:1.0"
+BASE_1_0 = "urn:ietf:params:netconf:base:1.0"
+BASE_1_1 = "urn:ietf:params:netconf:base:1.1"
+
+# The end of a message in the NETCONF 1.0 framing, used for the hello messages
+END_OF_MESSAGE = b"]]>]]>"
+
+# The latency percentiles reported for every operation
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+# The command of the stand-in server, taking the same arguments as netopeer2-server
+STAND_IN_COMMAND = (sys.executable, os.path.abspath(__file__))
+
+HELLO = (f'<hello xmlns="{BASE_NAMESPACE}"><capabilities><capability>{BASE_1_0}</capability>'
+         f'<capability>{BASE_1_1}</capability></capabilities>{{session_id}}</hello>')
+
+
+def _frame(message: bytes, chunked: bool) -> bytes:
+    if chunked:
+        return b"\n#%d\n" % len(message) + message + b"\n##\n"
+    return message + END_OF_MESSAGE
+
+
+async def _read_message(reader: asyncio.StreamReader, chunked: bool) -> bytes:
+    if not chunked:
+        return (await reader.readuntil(END_OF_MESSAGE))[:-len(END_OF_MESSAGE)].strip()
+    chunks = list()
+    while True:
+        if await reader.readexactly(2) != b"\n#":
+            raise ValueError("Invalid chunk header")
+        header = await reader.readuntil(b"\n")
+        if header == b"#\n":
+            return b"".join(chunks)
+        chunks.append(await reader.readexactly(int(header)))
+
+
+def _capabilities(hello: bytes) -> set:
+    root = ElementTree.fromstring(hello)
+    return {capability.text.strip() for capability in root.iter(f"{{{BASE_NAMESPACE}}}capability")}
+
+
+class NetconfSession:
+    """A NETCONF session over a UNIX socket, as opened by netconf-cli --socket.
+
+    The chunked framing of NETCONF 1.1 is used when the server supports it.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, chunked: bool) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._chunked = chunked
+        self._message_id = 0
+
+    @classmethod
+    async def connect(cls, socket_file: str) -> "NetconfSession":
+        """Opens a session and exchanges the hello messages.
+
+        Args:
+            socket_file (str): The UNIX socket of the server.
+
+        Returns:
+            NetconfSession: The session.
+        """
+
+        reader, writer = await asyncio.open_unix_connection(socket_file)
+        writer.write(_frame(HELLO.format(session_id="").encode(), False))
+        capabilities = _capabilities(await _read_message(reader, False))
+        return cls(reader, writer, BASE_1_1 in capabilities)
+
+    async def rpc(self, operation: str) -> bytes:
+        """Sends an RPC and waits for its reply.
+
+        Args:
+            operation (str): The XML of the operation inside the rpc element.
+
+        Returns:
+            bytes: The rpc-reply message.
+        """
+
+        self._message_id += 1
+        message = f'<rpc message-id="{self._message_id}" xmlns="{BASE_NAMESPACE}">{operation}</rpc>'
+        self._writer.write(_frame(message.encode(), self._chunked))
+        return await _read_message(self._reader, self._chunked)
+
+    async def close(self) -> None:
+        """Closes the session with close-session.
+
+        Returns:
+            None
+        """
+
+        try:
+            await self.rpc("<close-session/>")
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of sorted latencies.
+
+    Args:
+        latencies (list): The sorted latencies.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The percentile, NaN without latencies.
+    """
+
+    if not latencies:
+        return math.nan
+    return latencies[min(len(latencies) - 1, max(0, math.ceil(fraction * len(latencies)) - 1))]
+
+
+def _summarize(latencies: list, errors: int, duration: float) -> dict:
+    latencies.sort()
+    summary = {"requests": len(latencies), "errors": errors, "rps": len(latencies) / duration}
+    for name, fraction in PERCENTILES.items():
+        summary[name] = percentile(latencies, fraction)
+    return summary
+
+
+async def _run_load(socket_file: str, mix: list, sessions: int, duration: float, seed: int) -> dict:
+    names = [operation["name"] for operation in mix]
+    weights = [operation.get("weight", 1) for operation in mix]
+    templates = {operation["name"]: operation["rpc"] for operation in mix}
+    latencies = {name: list() for name in names}
+    errors = dict.fromkeys(names, 0)
+
+    opened = await asyncio.gather(*(NetconfSession.connect(socket_file) for _ in range(sessions)))
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def replay(index, session):
+        # Every session replays the same sequence on every prefix
+        generator = random.Random(seed + index)
+        sequence = 0
+        while time.perf_counter() < deadline:
+            name = generator.choices(names, weights)[0]
+            operation = templates[name].format(session=index, sequence=sequence)
+            sent = time.perf_counter()
+            reply = await session.rpc(operation)
+            latencies[name].append(time.perf_counter() - sent)
+            if b"rpc-error" in reply:
+                errors[name] += 1
+            sequence += 1
+
+    try:
+        await asyncio.gather(*(replay(index, session) for index, session in enumerate(opened)))
+    finally:
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*(session.close() for session in opened))
+
+    results = _summarize([latency for values in latencies.values() for latency in values], sum(errors.values()),
+                         elapsed)
+    results["duration"] = elapsed
+    results["operations"] = {name: _summarize(latencies[name], errors[name], elapsed) for name in names}
+    return results
+
+
+def run_load(socket_file: str, mix: list, sessions: int, duration: float, seed: int = 0) -> dict:
+    """Replays a mix of RPCs over concurrent sessions and measures their latencies.
+
+    Every session sends its next RPC as soon as the previous one is answered, until
+    the duration is over. The operations are drawn by their weights from a generator
+    seeded per session, so runs against different servers send the same RPCs.
+
+    Args:
+        socket_file (str): The UNIX socket of the server.
+        mix (list): The operations, each with its `name`, `rpc` template and `weight`. The `{session}`
+            and `{sequence}` fields of the template are replaced with the session and request numbers.
+        sessions (int): The number of concurrent sessions.
+        duration (float): The duration of the load in seconds.
+        seed (int, optional): The seed of the operation sequences.
+
+    Returns:
+        dict: The number of requests and errors, the requests per second and the latency percentiles in
+            seconds, overall and under `operations` per operation.
+    """
+
+    return asyncio.run(_run_load(socket_file, mix, sessions, duration, seed))
+
+
+def log_results(results: dict) -> None:
+    """Logs the results of several prefixes, compared with the first one.
+
+    Args:
+        results (dict): The results of run_load() by prefix.
+
+    Returns:
+        None
+    """
+
+    def line(name, summary):
+        percentiles = " ".join(f"{key} {summary[key] * 1000:7.2f}ms" for key in PERCENTILES)
+        return (f"{name:<20} {summary['requests']:8d} requests {summary['errors']:5d} errors "
+                f"{summary['rps']:9.1f} rps {percentiles}")
+
+    for prefix, result in results.items():
+        logger.info(line(prefix, result))
+        for name, summary in result["operations"].items():
+            logger.info(line(f"  {name}", summary))
+
+    def change(result, baseline, key):
+        # A baseline without answered requests has no rate or latencies to compare with
+        value, reference = result.get(key), baseline.get(key)
+        if value is None or reference is None or math.isnan(value) or math.isnan(reference) or not reference:
+            return "n/a"
+        return f"{value / reference - 1:+.1%}"
+
+    baseline_prefix, baseline = next(iter(results.items()))
+    for prefix, result in list(results.items())[1:]:
+        logger.info(f"{prefix} against {baseline_prefix}: {change(result, baseline, 'rps')} rps, "
+                    f"p99 {change(result, baseline, 'p99')}, p999 {change(result, baseline, 'p999')}")
+
+
+class _StandInServer:
+    """Answers get, get-config, edit-config and close-session from an in-memory datastore."""
+
+    def __init__(self) -> None:
+        self._running = ElementTree.Element(f"{{{BASE_NAMESPACE}}}data")
+        self._sessions = 0
+
+    def _reply(self, rpc: ElementTree.Element, content: str) -> bytes:
+        message_id = rpc.get("message-id", "")
+        return f'<rpc-reply message-id="{message_id}" xmlns="{BASE_NAMESPACE}">{content}</rpc-reply>'.encode()
+
+    def _handle(self, rpc: ElementTree.Element) -> str:
+        operation = rpc[0] if len(rpc) else None
+        name = operation.tag.rpartition("}")[2] if operation is not None else None
+        if name in ("get", "get-config"):
+            return ElementTree.tostring(self._running, encoding="unicode")
+        if name == "edit-config":
+            config = operation.find(f"{{{BASE_NAMESPACE}}}config")
+            for element in config if config is not None else []:
+                # Top-level nodes are replaced as a whole
+                for existing in self._running.findall(element.tag):
+                    self._running.remove(existing)
+                self._running.append(element)
+            return "<ok/>"
+        if name == "close-session":
+            return "<ok/>"
+        return ("<rpc-error><error-type>protocol</error-type><error-tag>operation-not-supported</error-tag>"
+                "<error-severity>error</error-severity></rpc-error>")
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._sessions += 1
+        session_id = f"<session-id>{self._sessions}</session-id>"
+        writer.write(_frame(HELLO.format(session_id=session_id).encode(), False))
+        try:
+            chunked = BASE_1_1 in _capabilities(await _read_message(reader, False))
+            while True:
+                rpc = ElementTree.fromstring(await _read_message(reader, chunked))
+                writer.write(_frame(self._reply(rpc, self._handle(rpc)), chunked))
+                await writer.drain()
+                if len(rpc) and rpc[0].tag == f"{{{BASE_NAMESPACE}}}close-session":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve_stand_in(socket_file: str) -> None:
+    server = await asyncio.start_unix_server(_StandInServer().serve, socket_file)
+    async with server:
+        await server.serve_forever()
+
+
+def serve_stand_in() -> None:
+    """Runs the stand-in NETCONF server, with the netopeer2-server arguments used by ServerPool.
+
+    Returns:
+        None
+    """
+
+    arg_parser = argparse.ArgumentParser(description="Stand-in NETCONF server for testing bench-netconf")
+    arg_parser.add_argument("-d", action="store_true", help="Ignored, the server never daemonizes")
+    arg_parser.add_argument("-U", type=str, required=True, metavar="SOCKET", help="The UNIX socket to listen on")
+    arg_parser.add_argument("-p", type=str, metavar="PID_FILE", help="The file to write the PID to")
+    args = arg_parser.parse_args()
+
+    if args.p is not None:
+        with open(args.p, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    asyncio.run(_serve_stand_in(args.U))
+
+
+if __name__ == "__main__":
+    serve_stand_in()
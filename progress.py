@@ -0,0 +1,244 @@
+import re
+import json
+import time
+import logging
+import threading
+import statistics
+
+from history import BuildHistory
+
+logger = logging.getLogger(__name__)
+
+# The "[finished/total] " status line Ninja prints for every edge
+NINJA_STATUS = re.compile(rb"^\[(\d+)/(\d+)\] ")
+
+# The build phases of a unit in their order
+PHASES = ("configure", "install")
+
+# The interval in seconds between the status events and dashboard lines
+DASHBOARD_INTERVAL = 10.0
+
+# The time in seconds without progress after which a phase is reported as stalled
+STALL_SECONDS = 300.0
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+class ProgressTracker:
+    """Follows the progress of concurrent builds and predicts when they finish.
+
+    The progress of the install phase is parsed from the Ninja status lines. The
+    expected durations of the phases are the medians of their previous successful
+    runs. Every change is written as a JSON line to the event file, a summary is
+    logged as a compact dashboard every DASHBOARD_INTERVAL seconds.
+    """
+
+    def __init__(self, history: BuildHistory = None, events_file: str = None) -> None:
+        self.history = history
+        self._events = None if events_file is None else open(events_file, 'a', buffering=1)
+        self._lock = threading.Lock()
+        self._events_lock = threading.Lock()
+        self._phases = dict()
+        self._expected = dict()
+        self._finished = set()
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+        self._ticker = None
+
+    def close(self) -> None:
+        """Stops the dashboard and closes the event file.
+
+        Returns:
+            None
+        """
+
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.join()
+        if self._events is not None:
+            self._events.close()
+
+    def _emit(self, event: str, **fields) -> None:
+        if self._events is not None:
+            line = json.dumps(dict(event=event, time=time.time(), **fields)) + "\n"
+            with self._events_lock:
+                self._events.write(line)
+
+    def _expected_duration(self, prefix: str, repository: str, phase: str) -> float:
+        if self.history is None:
+            return None
+        durations = self.history.phase_durations(prefix, repository, phase)
+        return statistics.median(durations) if durations else None
+
+    def plan(self, units: list) -> None:
+        """Starts tracking a set of units to be built, for the overall ETA.
+
+        Args:
+            units (list): The (prefix, repository) units.
+
+        Returns:
+            None
+        """
+
+        expected = {unit: [self._expected_duration(*unit, phase) for phase in PHASES] for unit in units}
+        with self._lock:
+            self._expected = expected
+            self._finished = set()
+            self._started = time.monotonic()
+        self._emit("plan", units=["/".join(unit) for unit in units])
+        if self._ticker is None:
+            self._ticker = threading.Thread(target=self._tick, daemon=True)
+            self._ticker.start()
+
+    def phase_started(self, prefix: str, repository: str, phase: str) -> None:
+        """Records the start of a build phase.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+
+        Returns:
+            None
+        """
+
+        now = time.monotonic()
+        expected = self._expected_duration(prefix, repository, phase)
+        with self._lock:
+            self._phases[(prefix, repository)] = {
+                "phase": phase, "started": now, "expected": expected, "done": 0, "total": None,
+                "progressed": now, "stalled": False,
+            }
+        self._emit("phase_started", prefix=prefix, repository=repository, phase=phase, expected=expected)
+
+    def output_line(self, prefix: str, repository: str, phase: str, line: bytes) -> None:
+        """Takes the progress of a build phase from a line of its output.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            line (bytes): The line of the output.
+
+        Returns:
+            None
+        """
+
+        match = NINJA_STATUS.match(line)
+        if match is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._phases.get((prefix, repository))
+            if state is None:
+                return
+            state.update(done=int(match.group(1)), total=int(match.group(2)), progressed=now, stalled=False)
+            fields = self._progress_fields(state, now)
+        self._emit("progress", prefix=prefix, repository=repository, phase=phase, **fields)
+
+    def phase_finished(self, prefix: str, repository: str, phase: str, succeeded: bool) -> None:
+        """Records the end of a build phase.
+
+        Args:
+            prefix (str): The name of the prefix.
+            repository (str): The name of the repository.
+            phase (str): The name of the phase.
+            succeeded (bool): Whether the phase succeeded.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            state = self._phases.pop((prefix, repository), None)
+        duration = None if state is None else time.monotonic() - state["started"]
+        self._emit("phase_finished", prefix=prefix, repository=repository, phase=phase, duration=duration,
+                   succeeded=succeeded)
+
+    def unit_finished(self, unit: tuple) -> None:
+        """Records that a unit is built, up to date or failed.
+
+        Args:
+            unit (tuple): The (prefix, repository) unit.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            self._finished.add(unit)
+            self._phases.pop(unit, None)
+
+    def _progress_fields(self, state: dict, now: float) -> dict:
+        elapsed = now - state["started"]
+        done, total, expected = state["done"], state["total"], state["expected"]
+        rate = done / elapsed if elapsed > 0 else 0.0
+        fraction = done / total if total else 0.0
+
+        # Trust the previous runs at the start and the measured rate towards the end
+        by_history = None if expected is None else max(expected - elapsed, 0.0)
+        by_rate = elapsed * (total - done) / done if done else None
+        if by_history is None:
+            eta = by_rate
+        elif by_rate is None:
+            eta = by_history
+        else:
+            eta = (1 - fraction) * by_history + fraction * by_rate
+        return {"done": done, "total": total, "rate": rate, "elapsed": elapsed, "eta": eta}
+
+    def _overall(self, now: float) -> dict:
+        known = [duration for durations in self._expected.values() for duration in durations if duration is not None]
+        if not known:
+            return {"units": len(self._expected), "finished": len(self._finished), "eta": None}
+        default = statistics.mean(known)
+
+        # The expected work left in seconds, and the work done per second of wall time so far
+        total = 0.0
+        remaining = 0.0
+        for unit, durations in self._expected.items():
+            durations = [default if duration is None else duration for duration in durations]
+            total += sum(durations)
+            if unit in self._finished:
+                continue
+            state = self._phases.get(unit)
+            if state is None:
+                remaining += sum(durations)
+                continue
+            phase_index = PHASES.index(state["phase"]) if state["phase"] in PHASES else 0
+            eta = self._progress_fields(state, now)["eta"]
+            remaining += (durations[phase_index] if eta is None else eta) + sum(durations[phase_index + 1:])
+        throughput = (total - remaining) / (now - self._started) if now > self._started else 0.0
+        eta = remaining / throughput if throughput > 0 else None
+        return {"units": len(self._expected), "finished": len(self._finished), "eta": eta}
+
+    def _tick(self) -> None:
+        while not self._stop.wait(DASHBOARD_INTERVAL):
+            now = time.monotonic()
+            stalled = list()
+            with self._lock:
+                overall = self._overall(now)
+                running = list()
+                for (prefix, repository), state in sorted(self._phases.items()):
+                    fields = self._progress_fields(state, now)
+                    running.append(dict(prefix=prefix, repository=repository, phase=state["phase"], **fields))
+                    if not state["stalled"] and now - state["progressed"] > STALL_SECONDS:
+                        state["stalled"] = True
+                        stalled.append((prefix, repository, state["phase"], now - state["progressed"]))
+            if not running:
+                continue
+
+            self._emit("status", running=running, **overall)
+            for prefix, repository, phase, idle in stalled:
+                self._emit("stalled", prefix=prefix, repository=repository, phase=phase, idle=idle)
+                logger.warning(f"{prefix}/{repository} made no {phase} progress for {_format_duration(idle)}")
+
+            builds = "; ".join(
+                f"{build['prefix']}/{build['repository']} {build['phase']}"
+                + (f" {build['done']}/{build['total']} {build['rate']:.1f}/s" if build["total"] else "")
+                + f" ETA {_format_duration(build['eta'])}" for build in running)
+            logger.info(f"[{overall['finished']}/{overall['units']} ETA {_format_duration(overall['eta'])}] {builds}")
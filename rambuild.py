@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+from trash import move_to_trash
+
+logger = logging.getLogger(__name__)
+
+# The tmpfs directory the build directories are kept in by default
+DEFAULT_RAM_DIR = f"/dev/shm/czechlight-build-{os.getuid()}"
+
+INDEX_FILE_NAME = "index.json"
+LOCK_FILE_NAME = ".lock"
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RamBuildDirs:
+    """Keeps the most recently used build directories on tmpfs within a memory budget.
+
+    A build directory in RAM is a symlink at its usual path to its copy in the RAM
+    directory, so the paths recorded by CMake and Ninja stay valid wherever its files
+    are. When the budget is exceeded, the least recently used directories that are not
+    being built are moved back to disk. The index of the RAM directory is shared by all
+    processes through a file lock. The contents of the RAM directory do not survive a
+    reboot, only the installed files are persisted.
+    """
+
+    def __init__(self, budget: int, ram_dir: str = DEFAULT_RAM_DIR, trash_dir: str = None) -> None:
+        self.budget = budget
+        self.ram_dir = ram_dir
+        self.trash_dir = trash_dir
+        self._lock = threading.Lock()
+        os.makedirs(ram_dir, exist_ok=True)
+
+    @contextmanager
+    def _index(self):
+        index_file = os.path.join(self.ram_dir, INDEX_FILE_NAME)
+        with self._lock, open(os.path.join(self.ram_dir, LOCK_FILE_NAME), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(index_file, 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = dict()
+            # Forget the directories that were cleaned or lost with a reboot
+            index = {build_dir: entry for build_dir, entry in index.items()
+                     if os.path.islink(build_dir) and os.path.isdir(entry["ram_path"])}
+            yield index
+            with open(f"{index_file}.tmp", 'w') as f:
+                json.dump(index, f)
+            os.replace(f"{index_file}.tmp", index_file)
+
+    def _discard(self, path: str) -> None:
+        if self.trash_dir is None:
+            shutil.rmtree(path)
+        else:
+            move_to_trash(path, self.trash_dir)
+
+    def _spill(self, build_dir: str, entry: dict) -> None:
+        spilled = f"{build_dir}.spill"
+        if os.path.exists(spilled):
+            shutil.rmtree(spilled)
+        shutil.copytree(entry["ram_path"], spilled, symlinks=True)
+        os.remove(build_dir)
+        os.rename(spilled, build_dir)
+        shutil.rmtree(entry["ram_path"])
+        logger.info(f"Moved {build_dir} back to disk ({entry['size'] / 2 ** 20:.0f} MiB)")
+
+    def _evict(self, index: dict, limit: int) -> None:
+        total = sum(entry["size"] for entry in index.values())
+        for build_dir, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= limit:
+                break
+            if any(_alive(pid) for pid in entry["pids"]):
+                continue
+            self._spill(build_dir, entry)
+            total -= entry["size"]
+            del index[build_dir]
+
+    def acquire(self, build_dir: str) -> None:
+        """Moves a build directory into RAM, if it fits into the budget, and keeps it there until released.
+
+        Args:
+            build_dir (str): The build directory of the repository, created if it does not exist.
+
+        Returns:
+            None
+        """
+
+        with self._index() as index:
+            entry = index.get(build_dir)
+            if entry is None:
+                # A symlink left without its RAM directory after a reboot
+                if os.path.islink(build_dir):
+                    os.remove(build_dir)
+                size = _tree_size(build_dir) if os.path.isdir(build_dir) else 0
+                if size > self.budget:
+                    logger.info(f"{build_dir} does not fit into the RAM budget, building it on disk")
+                    return
+                self._evict(index, self.budget - size)
+
+                ram_path = os.path.join(self.ram_dir, os.path.basename(os.path.dirname(build_dir)),
+                                        os.path.basename(build_dir))
+                if os.path.exists(ram_path):
+                    shutil.rmtree(ram_path)
+                os.makedirs(os.path.dirname(ram_path), exist_ok=True)
+                if os.path.isdir(build_dir):
+                    shutil.copytree(build_dir, ram_path, symlinks=True)
+                    on_disk = f"{build_dir}.disk"
+                    os.rename(build_dir, on_disk)
+                    os.symlink(ram_path, build_dir)
+                    self._discard(on_disk)
+                    logger.info(f"Moved {build_dir} to RAM ({size / 2 ** 20:.0f} MiB)")
+                else:
+                    os.makedirs(ram_path)
+                    os.makedirs(os.path.dirname(build_dir), exist_ok=True)
+                    os.symlink(ram_path, build_dir)
+                entry = index[build_dir] = {"ram_path": ram_path, "size": size, "pids": list()}
+            entry["last_used"] = time.time()
+            entry["pids"].append(os.getpid())
+
+    def release(self, build_dir: str) -> None:
+        """Lets a build directory be moved back to disk, and moves the least recently used ones there
+        until the budget is kept.
+
+        Args:
+            build_dir (str): The build directory of the repository.
+
+        Returns:
+            None
+        """
+
+        with self._index() as index:
+            entry = index.get(build_dir)
+            if entry is not None:
+                entry["size"] = _tree_size(entry["ram_path"])
+                entry["last_used"] = time.time()
+                if os.getpid() in entry["pids"]:
+                    entry["pids"].remove(os.getpid())
+            self._evict(index, self.budget)
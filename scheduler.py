@@ -0,0 +1,271 @@
+import math
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+class JobBudget:
+    """A global pool of build jobs shared by all concurrently running builds.
+
+    Every running build unit registers itself with the budget. When a unit is about
+    to start its build tool it takes a fair share of the free jobs (the capacity
+    divided by the number of registered units) and returns them once it is done.
+    """
+
+    # The interval in seconds after which a blocked request re-checks the budget, None to wait for a release
+    poll_interval = None
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self._free = self.capacity
+        self._units = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def unit(self):
+        """Registers a running build unit for the duration of the context."""
+        with self._condition:
+            self._units += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._units -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def jobs(self, job_rss: int = None):
+        """Takes a fair share of the free jobs for the duration of the context.
+
+        Blocks until at least one job is free.
+
+        Args:
+            job_rss (int, optional): The expected peak memory of one job in bytes.
+
+        Yields:
+            int: The number of jobs that were granted.
+        """
+        with self._condition:
+            while True:
+                granted = self._available(job_rss)
+                if granted > 0:
+                    break
+                self._condition.wait(self.poll_interval)
+            self._take(granted, job_rss)
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._release(granted, job_rss)
+                self._condition.notify_all()
+
+    def should_restart(self, granted: int, job_rss: int, elapsed: float) -> bool:
+        """Tells whether a running build should restart its build tool with a different number of jobs.
+
+        The fixed budget never asks for a restart.
+
+        Args:
+            granted (int): The number of jobs the build holds.
+            job_rss (int): The expected peak memory of one job in bytes, None if unknown.
+            elapsed (float): The time since the build tool started in seconds.
+
+        Returns:
+            bool: Whether the build should give back its jobs and take a new share.
+        """
+
+        return False
+
+    def _available(self, job_rss: int, held: int = 0) -> int:
+        # The number of jobs a request would get now, held is the number of jobs the requester gives back
+        free = self._free + held
+        if free == 0:
+            return 0
+        share = math.ceil(self.capacity / max(1, self._units))
+        return max(1, min(free, share))
+
+    def _take(self, granted: int, job_rss: int) -> None:
+        self._free -= granted
+
+    def _release(self, granted: int, job_rss: int) -> None:
+        self._free += granted
+
+
+def dependency_graph(repositories: dict, targets: list) -> dict:
+    """Creates the dependency graph of the selected targets.
+
+    Edges to repositories that are not among the targets are dropped, those are
+    expected to be installed already.
+
+    Args:
+        repositories (dict): The repository configurations with their `depends_on` lists.
+        targets (list): The names of the repositories to build.
+
+    Returns:
+        dict: A mapping of each target to the set of targets it depends on.
+    """
+
+    graph = dict()
+    for name in targets:
+        depends_on = repositories[name].get("depends_on") or list()
+        unknown = [dependency for dependency in depends_on if dependency not in repositories]
+        if unknown:
+            raise ValueError(f"Unknown dependencies of {name}: {', '.join(unknown)}")
+        graph[name] = {dependency for dependency in depends_on if dependency in targets}
+
+    topological_order(graph)
+    return graph
+
+
+def expand_graph(graph: dict, prefixes: list) -> dict:
+    """Repeats a dependency graph for every prefix.
+
+    Args:
+        graph (dict): A mapping of each repository to the set of repositories it depends on.
+        prefixes (list): The prefixes to build the repositories for.
+
+    Returns:
+        dict: A mapping of each (prefix, repository) unit to the set of units it depends on.
+    """
+
+    return {(prefix, name): {(prefix, dependency) for dependency in dependencies}
+            for prefix in prefixes for name, dependencies in graph.items()}
+
+
+def share_units(graph: dict, shared: dict) -> dict:
+    """Builds the units that several prefixes share once, in the prefix they are shared from.
+
+    Every shared unit depends only on the unit it is taken from, which takes over its
+    dependencies within its own prefix.
+
+    Args:
+        graph (dict): A mapping of each (prefix, repository) unit to the set of units it depends on.
+        shared (dict): A mapping of the shared units to the units they are taken from.
+
+    Returns:
+        dict: The graph with the units they are taken from added.
+    """
+
+    result = dict(graph)
+    for unit, source in shared.items():
+        if unit not in graph:
+            continue
+        result[source] = {(source[0], dependency) for _, dependency in graph[unit]}
+        result[unit] = {source}
+    return result
+
+
+def downstream(graph: dict, units: set) -> set:
+    """Finds the units of a dependency graph that depend on the given ones, directly or not.
+
+    Args:
+        graph (dict): A mapping of each unit to the set of units it depends on.
+        units (set): The units to start from.
+
+    Returns:
+        set: The given units together with everything downstream of them.
+    """
+
+    found = set(units) & set(graph)
+    added = True
+    while added:
+        added = {unit for unit, dependencies in graph.items() if unit not in found and dependencies & found}
+        found |= added
+    return found
+
+
+def upstream(graph: dict, units: set) -> set:
+    """Finds the units of a dependency graph that the given ones depend on, directly or not.
+
+    Args:
+        graph (dict): A mapping of each unit to the set of units it depends on.
+        units (set): The units to start from.
+
+    Returns:
+        set: The given units together with everything upstream of them.
+    """
+
+    found = set(units) & set(graph)
+    pending = list(found)
+    while pending:
+        for dependency in graph[pending.pop()]:
+            if dependency not in found:
+                found.add(dependency)
+                pending.append(dependency)
+    return found
+
+
+def topological_order(graph: dict) -> list:
+    """Orders the units of a dependency graph so that dependencies come first.
+
+    Args:
+        graph (dict): A mapping of each unit to the set of units it depends on.
+
+    Returns:
+        list: The units in dependency order.
+    """
+
+    order = list()
+    remaining = {unit: set(dependencies) for unit, dependencies in graph.items()}
+    while remaining:
+        ready = [unit for unit, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"Dependency cycle between: {', '.join(map(str, remaining))}")
+        for unit in ready:
+            del remaining[unit]
+            order.append(unit)
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return order
+
+
+def run_graph(graph: dict, run_unit, budget: JobBudget = None, max_workers: int = None,
+              keep_going: bool = False) -> list:
+    """Runs every unit of a dependency graph as soon as all of its dependencies are done.
+
+    When a unit fails no new units are started, the running ones are waited for. With
+    keep_going only the units that depend on the failed one are not started.
+
+    Args:
+        graph (dict): A mapping of each unit to the set of units it depends on.
+        run_unit (callable): Called with the unit to run it.
+        budget (JobBudget, optional): The job budget the running units are registered with.
+        max_workers (int, optional): The maximal number of units running at once.
+        keep_going (bool, optional): Whether to keep starting the units that do not depend on a failed one.
+
+    Returns:
+        dict: The exception of every unit that failed, reporting them is up to the caller.
+    """
+
+    def run(unit):
+        if budget is None:
+            return run_unit(unit)
+        with budget.unit():
+            return run_unit(unit)
+
+    pending = {unit: set(dependencies) for unit, dependencies in graph.items()}
+    failed = dict()
+    running = dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(graph))) as executor:
+        while pending or running:
+            if keep_going or not failed:
+                for unit in [unit for unit, dependencies in pending.items() if not dependencies]:
+                    del pending[unit]
+                    running[executor.submit(run, unit)] = unit
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    failed[unit] = error
+                    continue
+                for dependencies in pending.values():
+                    dependencies.discard(unit)
+
+    return failed
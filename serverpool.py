@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import signal
+import socket
+import logging
+import subprocess
+from contextlib import contextmanager
+
+from utils import clean_sysrepo_shm
+
+logger = logging.getLogger(__name__)
+
+SERVER_COMMAND = "netopeer2-server"
+
+SERVER_FILE_NAME = "server.json"
+LOCK_FILE_NAME = "lock"
+
+# The time in seconds a server has to start listening on its socket
+READY_TIMEOUT = 30.0
+
+# The interval in seconds between the readiness probes and between the attempts to find a free server
+PROBE_INTERVAL = 0.05
+
+# The time in seconds a server has to exit after SIGTERM before it is killed
+STOP_TIMEOUT = 10.0
+
+
+def _probe(socket_file: str) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_file)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class ServerPool:
+    """A pool of netopeer2-server instances of one prefix.
+
+    Every instance has its own directory in the run directory with its UNIX socket,
+    pid file, log and a copy of the sysrepo repository of the prefix, and its own
+    sysrepo shared memory prefix. Instances are handed out by acquire_server(), also
+    to other processes.
+    """
+
+    def __init__(self, run_dir: str, env: dict, size: int, command: tuple = (SERVER_COMMAND,)) -> None:
+        self.run_dir = run_dir
+        self.env = env
+        self.size = size
+        self.command = command
+        self._processes = dict()
+
+    def __enter__(self) -> "ServerPool":
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def _instance_dir(self, index: int) -> str:
+        return os.path.join(self.run_dir, f"server{index}")
+
+    def _shm_prefix(self, index: int) -> str:
+        # Not starting with the shared memory prefix of the prefix, whose cleaning would match it, and unique
+        # among the pools of the prefix
+        shm_prefix = self.env["SYSREPO_SHM_PREFIX"].removeprefix("sr_")
+        return f"sr_pool_{shm_prefix}_{os.path.basename(self.run_dir)}_s{index}"
+
+    def start(self) -> None:
+        """Starts all instances and waits until they listen on their sockets.
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: If an instance exits or does not listen in time.
+        """
+
+        os.makedirs(self.run_dir, exist_ok=True)
+        starting = dict()
+        for index in range(self.size):
+            instance_dir = self._instance_dir(index)
+            if os.path.exists(instance_dir):
+                shutil.rmtree(instance_dir)
+            os.makedirs(instance_dir)
+
+            server = {
+                "socket": os.path.join(instance_dir, "netopeer2-server.sock"),
+                "pid_file": os.path.join(instance_dir, "netopeer2-server.pid"),
+                "env": {
+                    "SYSREPO_SHM_PREFIX": self._shm_prefix(index),
+                    "SYSREPO_REPOSITORY_PATH": os.path.join(instance_dir, "repository"),
+                },
+            }
+            # Every instance starts from the modules installed into the repository of the prefix
+            if os.path.isdir(self.env["SYSREPO_REPOSITORY_PATH"]):
+                shutil.copytree(self.env["SYSREPO_REPOSITORY_PATH"], server["env"]["SYSREPO_REPOSITORY_PATH"],
+                                symlinks=True)
+            clean_sysrepo_shm(server["env"]["SYSREPO_SHM_PREFIX"])
+
+            with open(os.path.join(instance_dir, "server.log"), "wb") as log:
+                process = subprocess.Popen([*self.command, "-d", f"-U{server['socket']}", "-p", server["pid_file"]],
+                                           env=dict(self.env, **server["env"]), stdin=subprocess.DEVNULL,
+                                           stdout=log, stderr=subprocess.STDOUT)
+            self._processes[index] = process
+            starting[index] = server
+
+        deadline = time.monotonic() + READY_TIMEOUT
+        while starting:
+            for index, server in list(starting.items()):
+                if self._processes[index].poll() is not None:
+                    self.stop()
+                    raise RuntimeError(f"Server {index} exited with {self._processes[index].returncode}, see "
+                                       f"{os.path.join(self._instance_dir(index), 'server.log')}")
+                if _probe(server["socket"]):
+                    server["pid"] = self._processes[index].pid
+                    with open(os.path.join(self._instance_dir(index), SERVER_FILE_NAME), 'w') as f:
+                        json.dump(server, f)
+                    logger.info(f"Server {index} is listening on {server['socket']}")
+                    del starting[index]
+            if starting and time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError(f"Servers {', '.join(map(str, starting))} did not start within {READY_TIMEOUT}s")
+            if starting:
+                time.sleep(PROBE_INTERVAL)
+
+    def stop(self) -> None:
+        """Stops all instances and removes their state.
+
+        Returns:
+            None
+        """
+
+        for process in self._processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for index, process in self._processes.items():
+            try:
+                process.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Server {index} did not stop, killing it")
+                process.kill()
+                process.wait()
+            clean_sysrepo_shm(self._shm_prefix(index))
+            shutil.rmtree(self._instance_dir(index), ignore_errors=True)
+        self._processes.clear()
+
+
+@contextmanager
+def acquire_server(run_dir: str, timeout: float = None):
+    """Takes a free server of a pool for the duration of the context.
+
+    Servers are locked with a file lock, so the pool can be shared by several processes.
+
+    Args:
+        run_dir (str): The run directory of the pool.
+        timeout (float, optional): The maximal time to wait for a free server in seconds, forever if None.
+
+    Yields:
+        dict: The server with its `socket` and the sysrepo `env` variables of its instance.
+
+    Raises:
+        TimeoutError: If no server became free in time.
+    """
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        names = sorted(os.listdir(run_dir)) if os.path.isdir(run_dir) else list()
+        for name in names:
+            server_file = os.path.join(run_dir, name, SERVER_FILE_NAME)
+            if not os.path.exists(server_file):
+                continue
+            lock = open(os.path.join(run_dir, name, LOCK_FILE_NAME), 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+            try:
+                with open(server_file, 'r') as f:
+                    server = json.load(f)
+                # Skip the servers of a pool that did not stop cleanly
+                if not _probe(server["socket"]):
+                    continue
+                yield server
+                return
+            finally:
+                lock.close()
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"No free server in {run_dir}")
+        time.sleep(PROBE_INTERVAL)
@@ -0,0 +1,169 @@
+import os
+import json
+import hashlib
+import logging
+import subprocess
+
+from cmakecache import resolve_program
+
+logger = logging.getLogger(__name__)
+
+STAMP_DIR_NAME = ".stamps"
+
+# Compares the sources with the stamp of the last successful build instead of a Git reference
+LAST_BUILD = "last-build"
+
+# The variables set by load_env() that influence the result of a build, the search paths are left out so
+# that a different shell does not invalidate the stamps
+BUILD_ENV_VARIABLES = ["CC", "CXX", "CFLAGS", "CXXFLAGS", "LDFLAGS"]
+
+# The variables naming the compilers, which are fingerprinted by their path and version
+COMPILER_VARIABLES = ["CC", "CXX"]
+
+
+def _git(args: list, src_dir: str) -> bytes:
+    return subprocess.run(["git"] + args, cwd=src_dir, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+
+def source_fingerprint(src_dir: str) -> dict:
+    """Fingerprints the source tree of a repository.
+
+    Args:
+        src_dir (str): The directory where the source code is located.
+
+    Returns:
+        dict: The checked out commit and the hash of the uncommitted changes (None for
+            a clean tree), or None if the source is not a Git working tree.
+    """
+
+    try:
+        head = _git(["rev-parse", "HEAD"], src_dir).decode().strip()
+        changes = _git(["diff", "HEAD", "--binary"], src_dir)
+        untracked = _git(["ls-files", "--others", "--exclude-standard", "-z"], src_dir)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    if not changes and not untracked:
+        return {"head": head, "dirty": None}
+
+    digest = hashlib.sha256(changes)
+    for path in sorted(filter(None, untracked.split(b"\0"))):
+        digest.update(path + b"\0")
+        full_path = os.path.join(os.fsencode(src_dir), path)
+        if os.path.isfile(full_path):
+            with open(full_path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return {"head": head, "dirty": digest.hexdigest()}
+
+
+def changed_since(src_dir: str, since: str, stamp: dict) -> bool:
+    """Tells whether the source tree of a repository changed.
+
+    Args:
+        src_dir (str): The directory where the source code is located.
+        since (str): A Git reference, or LAST_BUILD to compare with the last successful build.
+        stamp (dict): The stamp of the last successful build, None if there is none.
+
+    Returns:
+        bool: Whether there are new commits or uncommitted changes.
+    """
+
+    source = source_fingerprint(src_dir)
+    if source is None:
+        return True
+    if since == LAST_BUILD:
+        return stamp is None or stamp.get("source") != source
+    if source["dirty"] is not None:
+        return True
+
+    try:
+        count = _git(["rev-list", "--count", f"{since}..HEAD"], src_dir)
+    except subprocess.CalledProcessError:
+        logger.warning(f"{src_dir} has no {since}, considering it changed")
+        return True
+    return int(count) > 0
+
+
+def create_stamp(src_dir: str, cmake_command: list, env: dict, upstream: dict) -> dict:
+    """Creates the stamp describing everything a build of a repository depends on.
+
+    Args:
+        src_dir (str): The directory where the source code is located.
+        cmake_command (list): The resolved CMake command line.
+        env (dict): The build environment.
+        upstream (dict): The fingerprints of the upstream repositories by name.
+
+    Returns:
+        dict: The stamp, or None if the build can not be fingerprinted.
+    """
+
+    source = source_fingerprint(src_dir)
+    if source is None or None in upstream.values():
+        return None
+
+    stamp = {
+        "source": source,
+        "cmake": cmake_command,
+        "env": {name: env.get(name) for name in BUILD_ENV_VARIABLES},
+        "compilers": {name: resolve_program(env[name], env) for name in COMPILER_VARIABLES if env.get(name)},
+        "upstream": upstream,
+    }
+    encoded = json.dumps(stamp, sort_keys=True).encode()
+    stamp["fingerprint"] = hashlib.sha256(encoded).hexdigest()
+    return stamp
+
+
+def read_stamp(stamp_dir: str, repository_name: str) -> dict:
+    """Reads the stamp of the last successful build of a repository.
+
+    Args:
+        stamp_dir (str): The directory where the stamps are stored.
+        repository_name (str): The name of the repository.
+
+    Returns:
+        dict: The stamp, or None if there is none.
+    """
+
+    stamp_file = os.path.join(stamp_dir, f"{repository_name}.json")
+    try:
+        with open(stamp_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_stamp(stamp_dir: str, repository_name: str, stamp: dict) -> None:
+    """Stores the stamp of a successful build of a repository.
+
+    Args:
+        stamp_dir (str): The directory where the stamps are stored.
+        repository_name (str): The name of the repository.
+        stamp (dict): The stamp to store.
+
+    Returns:
+        None
+    """
+
+    os.makedirs(stamp_dir, exist_ok=True)
+    stamp_file = os.path.join(stamp_dir, f"{repository_name}.json")
+    with open(f"{stamp_file}.tmp", 'w') as f:
+        json.dump(stamp, f, indent=2, sort_keys=True)
+    os.replace(f"{stamp_file}.tmp", stamp_file)
+
+
+def remove_stamp(stamp_dir: str, repository_name: str) -> None:
+    """Forgets the last successful build of a repository.
+
+    Args:
+        stamp_dir (str): The directory where the stamps are stored.
+        repository_name (str): The name of the repository.
+
+    Returns:
+        None
+    """
+
+    stamp_file = os.path.join(stamp_dir, f"{repository_name}.json")
+    if os.path.exists(stamp_file):
+        os.remove(stamp_file)
+        logger.info(f"Removed {stamp_file}")
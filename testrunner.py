@@ -0,0 +1,154 @@
+import os
+import json
+import math
+import time
+import queue
+import shutil
+import logging
+import subprocess
+import contextlib
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+from history import BuildHistory
+from serverpool import acquire_server
+from utils import clean_sysrepo_shm
+
+logger = logging.getLogger(__name__)
+
+# The size of the output kept for a failed test
+OUTPUT_TAIL = 16 * 1024
+
+
+def list_tests(build_dir: str, env: dict) -> list:
+    """Lists the CTest tests of a build directory.
+
+    Args:
+        build_dir (str): The build directory.
+        env (dict): The environment variables.
+
+    Returns:
+        list: The test names, in the order of their CTest numbers.
+    """
+
+    if not os.path.exists(os.path.join(build_dir, "CTestTestfile.cmake")):
+        return list()
+    output = subprocess.run(["ctest", "--show-only=json-v1"], cwd=build_dir, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return [test["name"] for test in json.loads(output)["tests"]]
+
+
+def run_tests(suites: list, workers: int, state_dir: str, history: BuildHistory = None,
+              server_dirs: dict = None) -> list:
+    """Runs the CTest tests of several build directories through a pool of workers.
+
+    Every worker has its own sysrepo shared memory prefix and repository, which are
+    wiped after every test. The tests that took the longest last time run first.
+
+    Args:
+        suites (list): The (prefix, repository, build_dir, env) tuples of the build directories.
+        workers (int): The number of tests running at once.
+        state_dir (str): The directory for the sysrepo repositories of the workers.
+        history (BuildHistory, optional): The history to take the durations from and record the results in.
+        server_dirs (dict, optional): The run directories of the netopeer2-server pools by prefix. Every
+            test of a prefix with a pool gets a free server in NETOPEER2_SOCKET and shares its sysrepo state.
+
+    Returns:
+        list: The results of the tests.
+    """
+
+    tasks = list()
+    for prefix, repository, build_dir, env in suites:
+        durations = history.test_durations(prefix, repository) if history is not None else dict()
+        for number, name in enumerate(list_tests(build_dir, env), start=1):
+            # Tests that never ran are presumed to be long
+            tasks.append((durations.get(name, math.inf), prefix, repository, build_dir, env, number, name))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    logger.info(f"Running {len(tasks)} tests with {workers} workers...")
+
+    slots = queue.Queue()
+    for slot in range(workers):
+        slots.put(slot)
+
+    def run(task):
+        _, prefix, repository, build_dir, env, number, name = task
+        slot = slots.get()
+        shm_prefix = f"sr_test{os.getpid()}w{slot}"
+        repository_dir = os.path.join(state_dir, f"worker{slot}")
+        test_env = dict(env, SYSREPO_SHM_PREFIX=shm_prefix, SYSREPO_REPOSITORY_PATH=repository_dir)
+        try:
+            with contextlib.ExitStack() as stack:
+                if server_dirs and prefix in server_dirs:
+                    server = stack.enter_context(acquire_server(server_dirs[prefix]))
+                    test_env.update(server["env"], NETOPEER2_SOCKET=server["socket"])
+                started = time.monotonic()
+                process = subprocess.run(["ctest", "-I", f"{number},{number}", "--output-on-failure"],
+                                         cwd=build_dir, env=test_env, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                duration = time.monotonic() - started
+        finally:
+            clean_sysrepo_shm(shm_prefix)
+            shutil.rmtree(repository_dir, ignore_errors=True)
+            slots.put(slot)
+
+        passed = process.returncode == 0
+        if history is not None:
+            history.record_test(prefix, repository, name, duration, passed)
+        logger.info(f"{'Passed' if passed else 'FAILED'} {prefix}/{repository} {name} ({duration:.1f}s)")
+        return {
+            "prefix": prefix,
+            "repository": repository,
+            "test": name,
+            "duration": duration,
+            "passed": passed,
+            "output": "" if passed else process.stdout[-OUTPUT_TAIL:].decode(errors="replace"),
+        }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, tasks))
+
+
+def write_reports(results: list, report_dir: str) -> None:
+    """Writes the merged results of all tests as JSON and JUnit XML.
+
+    Args:
+        results (list): The results of the tests.
+        report_dir (str): The directory to write test-report.json and test-report.xml to.
+
+    Returns:
+        None
+    """
+
+    os.makedirs(report_dir, exist_ok=True)
+    json_file = os.path.join(report_dir, "test-report.json")
+    with open(json_file, 'w') as f:
+        json.dump({
+            "tests": len(results),
+            "failures": sum(not result["passed"] for result in results),
+            "results": results,
+        }, f, indent=2)
+
+    suites = dict()
+    for result in results:
+        suites.setdefault((result["prefix"], result["repository"]), list()).append(result)
+
+    root = ElementTree.Element("testsuites")
+    for (prefix, repository), suite_results in sorted(suites.items()):
+        suite = ElementTree.SubElement(root, "testsuite", {
+            "name": f"{prefix}/{repository}",
+            "tests": str(len(suite_results)),
+            "failures": str(sum(not result["passed"] for result in suite_results)),
+            "time": f"{sum(result['duration'] for result in suite_results):.3f}",
+        })
+        for result in sorted(suite_results, key=lambda result: result["test"]):
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": f"{prefix}.{repository}",
+                "name": result["test"],
+                "time": f"{result['duration']:.3f}",
+            })
+            if not result["passed"]:
+                ElementTree.SubElement(case, "failure", {"message": "Test failed"}).text = result["output"]
+
+    xml_file = os.path.join(report_dir, "test-report.xml")
+    ElementTree.ElementTree(root).write(xml_file, encoding="utf-8", xml_declaration=True)
+    logger.info(f"Wrote {json_file} and {xml_file}")
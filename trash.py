@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import fcntl
+import shutil
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TRASH_DIR_NAME = ".trash"
+
+LOCK_FILE_NAME = ".lock"
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def move_to_trash(path: str, trash_dir: str) -> None:
+    """Moves a file or directory into the trash, from where the reaper deletes it.
+
+    The path is renamed, so it disappears at once. Paths on another filesystem than
+    the trash are deleted right away.
+
+    Args:
+        path (str): The path to remove.
+        trash_dir (str): The trash directory.
+
+    Returns:
+        None
+    """
+
+    if not os.path.lexists(path):
+        return
+
+    os.makedirs(trash_dir, exist_ok=True)
+    trashed = os.path.join(trash_dir, f"{time.time_ns()}-{os.getpid()}-{os.path.basename(os.path.normpath(path))}")
+    try:
+        os.rename(path, trashed)
+    except OSError as e:
+        logger.warning(f"Failed to move {path} to the trash, removing it now: {e}")
+        _remove(path)
+
+
+def start_reaper(trash_dir: str) -> None:
+    """Starts a background process emptying the trash, unless the trash is empty.
+
+    The process outlives this one. Whatever it does not finish is picked up by the
+    next reaper.
+
+    Args:
+        trash_dir (str): The trash directory.
+
+    Returns:
+        None
+    """
+
+    if not os.path.isdir(trash_dir) or not set(os.listdir(trash_dir)) - {LOCK_FILE_NAME}:
+        return
+
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), trash_dir], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    logger.info(f"Emptying {trash_dir} in the background")
+
+
+def reap(trash_dir: str, workers: int = None) -> None:
+    """Empties the trash, deleting the top-level entries of every trashed tree in parallel.
+
+    Only one reaper runs at a time, the others wait for it and then delete what was
+    trashed in the meantime.
+
+    Args:
+        trash_dir (str): The trash directory.
+        workers (int, optional): The number of deleting processes, the number of CPUs by default.
+
+    Returns:
+        None
+    """
+
+    os.makedirs(trash_dir, exist_ok=True)
+    with open(os.path.join(trash_dir, LOCK_FILE_NAME), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                trashed = [os.path.join(trash_dir, name) for name in os.listdir(trash_dir) if name != LOCK_FILE_NAME]
+                if not trashed:
+                    break
+                paths = list()
+                for path in trashed:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        paths += [entry.path for entry in os.scandir(path)]
+                list(executor.map(_remove, paths))
+                list(executor.map(_remove, trashed))
+
+
+if __name__ == "__main__":
+    reap(sys.argv[1])
@@ -1,12 +1,34 @@
 import os
 import shutil
 import logging
+import time
+import signal
+import tarfile
 import subprocess
 
+from cache import ArtifactCache, artifact_key, link_installed, read_manifest
+from cmakecache import ProbeCache, configure_changes, read_cmake_cache, remove_cmake_cache
+from buildlog import LoggedProcessError, phase_log_file, run_logged
+from history import BuildHistory, ninja_log_size, read_ninja_log
+from progress import ProgressTracker
+from rambuild import RamBuildDirs
+from scheduler import JobBudget
+from trash import move_to_trash
+from stamps import STAMP_DIR_NAME, create_stamp, read_stamp, write_stamp, remove_stamp
+
 logger = logging.getLogger(__name__)
 
+SHM_DIR = "/dev/shm"
+
+# The interval in seconds in which a running build asks the job budget whether to restart with other jobs
+ADJUST_INTERVAL = 2.0
+
+
 def install(repository_name: str, src_dir: str, build_dir: str, install_dir: str,
-            env: dict, cmake_args: list, num_jobs: int = 4) -> None:
+            env: dict, cmake_args: list, num_jobs: int = 4, budget: JobBudget = None,
+            upstream: list = (), force: bool = False, cache: ArtifactCache = None, log_dir: str = None,
+            history: BuildHistory = None, build_type: str = "Debug", progress: ProgressTracker = None,
+            ram: RamBuildDirs = None, probes: ProbeCache = None) -> None:
     """Builds and installs a repository using CMake and Ninja.
 
     Args:
@@ -14,48 +36,231 @@ def install(repository_name: str, src_dir: str, build_dir: str, install_dir: str
         src_dir (str): The directory where the source code is located.
         build_dir (str): The directory where the build files are located.
         install_dir (str): The directory where the installation files are located.
-        log_dir (str): The directory where the log files are located.
         env (dict): The environment variables.
-        cmake_args (list, optional): Additional arguments to pass to CMake.
+        cmake_args (list, optional): Additional arguments to pass to CMake, `{install_dir}` is replaced
+            by the installation directory.
         num_jobs (int, optional): The number of jobs to run simultaneously.
+        budget (JobBudget, optional): The global job budget to take the jobs from instead of num_jobs.
+        upstream (list, optional): The names of the repositories this one depends on.
+        force (bool, optional): Whether to build even if the previous build is up to date.
+        cache (ArtifactCache, optional): The store to take identical builds from and to store new builds in.
+        log_dir (str, optional): The directory the output of every phase is logged to instead of the console.
+        history (BuildHistory, optional): The history to record the durations of the phases and targets in.
+        build_type (str, optional): The CMake build type.
+        progress (ProgressTracker, optional): The tracker to report the progress of the phases to.
+        ram (RamBuildDirs, optional): The RAM to keep the build directory in while it is used.
+        probes (ProbeCache, optional): The configure check results to start the first configure with
+            and to add the new ones to.
 
     Returns:
         None
+
+    Raises:
+        subprocess.CalledProcessError: If the build fails.
     """
 
+    prefix = os.path.basename(os.path.normpath(build_dir))
+    stamp_dir = os.path.join(build_dir, STAMP_DIR_NAME)
     src_dir = os.path.join(src_dir, repository_name)
     build_dir = os.path.join(build_dir, repository_name)
 
+    build_args = ["-GNinja",
+                  "-DCMAKE_EXPORT_COMPILE_COMMANDS=1",
+                  f"-DCMAKE_BUILD_TYPE={build_type}",
+                  # "-DBOOST_ROOT=/usr"]
+                  ] + [arg.format(install_dir=install_dir) for arg in cmake_args]
+    cmake_command = ["cmake", src_dir,
+                     f"-DCMAKE_INSTALL_PREFIX:PATH={install_dir}",
+                     f"-DCMAKE_PREFIX_PATH:PATH={install_dir}"] + build_args
+
+    # Skip the build if nothing changed since the last successful one
+    upstream_fingerprints = {name: (read_stamp(stamp_dir, name) or dict()).get("fingerprint")
+                             for name in upstream}
+    stamp = create_stamp(src_dir, cmake_command, env, upstream_fingerprints)
+    previous_stamp = read_stamp(stamp_dir, repository_name)
+    if not force and stamp is not None and previous_stamp is not None \
+            and previous_stamp.get("fingerprint") == stamp["fingerprint"]:
+        logger.info(f"{repository_name} is up to date")
+        return
+
+    # Install the files of an identical build from the cache, a forced build still replaces the cached one
+    artifact = None
+    if cache is not None:
+        upstream_artifacts = {name: (read_stamp(stamp_dir, name) or dict()).get("artifact")
+                              for name in upstream}
+        artifact = artifact_key(repository_name, stamp, build_args, env, upstream_artifacts)
+    if artifact is not None:
+        stamp["artifact"] = artifact
+        if not force and cache.unpack(artifact, install_dir, build_dir):
+            write_stamp(stamp_dir, repository_name, stamp)
+            return
+
     # Remove the previous build directory
     if os.path.exists(build_dir):
         pass
         # shutil.rmtree(build_dir)
     else:
+        # A build directory that was in RAM before a reboot
+        if os.path.islink(build_dir):
+            os.remove(build_dir)
         os.makedirs(build_dir)
 
+    # Installed files may be hardlinks shared with other prefixes, replace them instead of writing through them
+    for path in read_manifest(build_dir):
+        if not os.path.islink(path) and os.path.isfile(path) and os.stat(path).st_nlink > 1:
+            os.remove(path)
+
+    # Whether the job budget interrupted the build tool to restart it with another number of jobs, and the
+    # (start, duration) of the interrupted attempts of the phase so far
+    restarted = False
+    interrupted = None
+
+    def run(phase, command, monitor=None):
+        nonlocal interrupted
+        started = time.time()
+        ninja_log_offset = ninja_log_size(build_dir)
+        completed = False
+        succeeded = False
+        on_line = None
+        if progress is not None:
+            progress.phase_started(prefix, repository_name, phase)
+
+            def on_line(line):
+                progress.output_line(prefix, repository_name, phase, line)
+
+        try:
+            log_file = None if log_dir is None else phase_log_file(log_dir, repository_name, phase)
+            usage = run_logged(command, build_dir, env, log_file, monitor=monitor, on_line=on_line,
+                               append=interrupted is not None)
+            completed = True
+            succeeded = not restarted
+        finally:
+            if progress is not None:
+                progress.phase_finished(prefix, repository_name, phase, succeeded)
+
+            # The interrupted attempts are recorded together with the one that finishes the phase
+            first_started, earlier = interrupted or (started, 0.0)
+            duration = earlier + time.time() - started
+            interrupted = (first_started, duration) if completed and restarted else None
+            if history is not None:
+                if interrupted is None:
+                    history.record_phase(prefix, repository_name, phase, first_started, duration, succeeded)
+                if command[0] == "ninja":
+                    history.record_targets(prefix, repository_name, read_ninja_log(build_dir, ninja_log_offset))
+        if history is not None:
+            # ru_maxrss is the peak of the largest process, in KiB
+            history.record_peak_rss(prefix, repository_name, phase, usage.ru_maxrss * 1024)
+
+    # Keep the build directory in RAM while it is built, the build tools see the same path
+    if ram is not None:
+        ram.acquire(build_dir)
     try:
-        logger.info(f"Building {repository_name}...")
-        subprocess.run(
-            ["cmake", src_dir, "-GNinja",
-             f"-DCMAKE_INSTALL_PREFIX:PATH={install_dir}",
-             f"-DCMAKE_PREFIX_PATH:PATH={install_dir}",
-             "-DCMAKE_EXPORT_COMPILE_COMMANDS=1",
-             "-DCMAKE_BUILD_TYPE=Debug",
-             # "-DBOOST_ROOT=/usr"]
-             ]
-            + cmake_args,
-            cwd=build_dir, env=env, check=True)
-        logger.info(f"Installing {repository_name}...")
-        subprocess.run(["ninja", "install", f"-j{num_jobs}"],
-                       cwd=build_dir, env=env, check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error occurred: {e}")
-        exit(1)
+        logger.info(f"Building {repository_name} in {build_dir}...")
+        changes = configure_changes(build_dir, cmake_command, env)
+        if changes:
+            for change, _ in changes:
+                logger.info(f"Configuring {repository_name}: {change}")
+            if any(fresh for _, fresh in changes):
+                remove_cmake_cache(build_dir)
+
+            # A first configure takes the known configure check results of the toolchain
+            configure_command = cmake_command
+            initial_cache = None if probes is None or read_cmake_cache(build_dir) is not None \
+                else probes.initial_cache(env, build_type)
+            if initial_cache is not None:
+                configure_command = cmake_command[:1] + ["-C", initial_cache] + cmake_command[1:]
+            run("configure", configure_command)
+            if probes is not None:
+                probes.record(build_dir, cmake_command, env, build_type)
+        else:
+            logger.info(f"{repository_name} is configured already")
+        if budget is None:
+            logger.info(f"Installing {repository_name}...")
+            run("install", ["ninja", "install", f"-j{num_jobs}"])
+        else:
+            while True:
+                # A restarted build recorded the peak memory of its jobs so far as well
+                job_rss = history.peak_rss(prefix, repository_name, "install") if history is not None else None
+                with budget.jobs(job_rss) as jobs:
+                    logger.info(f"Installing {repository_name} with {jobs} jobs...")
+                    restarted = False
+
+                    def monitor(process, finished):
+                        # Ninja stops its jobs on SIGINT and picks up where it stopped when run again
+                        nonlocal restarted
+                        started = time.monotonic()
+                        while not finished.wait(ADJUST_INTERVAL):
+                            if budget.should_restart(jobs, job_rss, time.monotonic() - started):
+                                restarted = True
+                                process.send_signal(signal.SIGINT)
+                                return True
+                        return False
+
+                    run("install", ["ninja", "install", f"-j{jobs}"], monitor)
+                if not restarted:
+                    break
+                logger.info(f"Restarting the installation of {repository_name} with a new number of jobs")
+    finally:
+        if ram is not None:
+            ram.release(build_dir)
+
+    if artifact is not None:
+        try:
+            cache.store(artifact, repository_name, install_dir, build_dir)
+        except (OSError, tarfile.TarError) as e:
+            logger.warning(f"Failed to store {repository_name} in the cache: {e}")
+            del stamp["artifact"]
+
+    if stamp is not None:
+        write_stamp(stamp_dir, repository_name, stamp)
 
     logger.info(f"Finished installation of {repository_name}")
 
 
-def clean(repository_name: str, build_dir: str, log_dir: str) -> None:
+def link_shared(repository_name: str, shared_build_dir: str, shared_install_dir: str, build_dir: str,
+                install_dir: str, force: bool = False) -> None:
+    """Installs a repository built in a shared prefix by hardlinking its installed files.
+
+    The stamp of the shared build is taken over, so the repositories depending on this
+    one see the same fingerprint as in the shared prefix.
+
+    Args:
+        repository_name (str): The name of the repository to install.
+        shared_build_dir (str): The build directory of the shared prefix.
+        shared_install_dir (str): The installation directory of the shared prefix.
+        build_dir (str): The build directory of the prefix to install into.
+        install_dir (str): The installation directory of the prefix to install into.
+        force (bool, optional): Whether to link even if the files of the shared build are linked already.
+
+    Returns:
+        None
+
+    Raises:
+        OSError, ValueError: If the files can not be linked.
+    """
+
+    shared_stamp = read_stamp(os.path.join(shared_build_dir, STAMP_DIR_NAME), repository_name)
+    stamp_dir = os.path.join(build_dir, STAMP_DIR_NAME)
+    build_dir = os.path.join(build_dir, repository_name)
+    if not force and shared_stamp is not None and read_stamp(stamp_dir, repository_name) == shared_stamp \
+            and read_manifest(build_dir):
+        logger.info(f"{repository_name} is up to date")
+        return
+
+    try:
+        link_installed(shared_install_dir, os.path.join(shared_build_dir, repository_name), install_dir, build_dir)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to link {repository_name} from {shared_install_dir}: {e}")
+        raise
+
+    if shared_stamp is not None:
+        write_stamp(stamp_dir, repository_name, shared_stamp)
+    else:
+        remove_stamp(stamp_dir, repository_name)
+    logger.info(f"Linked {repository_name} from {shared_install_dir} into {install_dir}")
+
+
+def clean(repository_name: str, build_dir: str, log_dir: str, trash_dir: str = None) -> None:
     """Cleans up a previously downloaded and installed repository.
 
     Args:
@@ -63,56 +268,197 @@ def clean(repository_name: str, build_dir: str, log_dir: str) -> None:
         src_dir (str): The directory where the source code is located.
         build_dir (str): The directory where the build files are located.
         log_dir (str): The directory where the log files are located.
+        trash_dir (str, optional): The trash to move the directories into instead of deleting them.
 
     Returns:
         None
     """
 
+    prefix = os.path.basename(os.path.normpath(build_dir))
+    stamp_dir = os.path.join(build_dir, STAMP_DIR_NAME)
     build_dir = os.path.join(build_dir, repository_name)
-    log_file = os.path.join(log_dir, f"{repository_name}.log")
+    repository_log_dir = os.path.join(log_dir, repository_name)
 
-    # Remove the build directory
-    if os.path.exists(build_dir):
-        shutil.rmtree(build_dir)
+    # Remove the build directory, together with its copy in RAM
+    if os.path.islink(build_dir):
+        shutil.rmtree(os.path.realpath(build_dir), ignore_errors=True)
+        os.remove(build_dir)
+        logger.info(f"Removed {build_dir}")
+    elif os.path.exists(build_dir):
+        _remove_tree(build_dir, trash_dir)
         logger.info(f"Removed {build_dir}")
 
-    # Remove all the files that contain 'sr' in the /dev/shm directory
-    if repository_name == "sysrepo" and os.path.exists("/dev/shm"):
-        logger.info(f"Removing from /dev/shm...")
-        for root, dirs, files in os.walk("/dev/shm"):
-            for file in files + dirs:
-                if repository_name in file:
-                    path = os.path.join(root, file)
-                    logger.info(f"Removing {path}")
-                    if os.path.isfile(path):
-                        os.remove(path)
-                    elif os.path.islink(path):
-                        os.unlink(path)
-                    elif os.path.isdir(path):
-                        shutil.rmtree(path)
-
-    # Remove the log file
-    if os.path.exists(log_file):
-        os.remove(log_file)
-        logger.info(f"Removed {log_file}")
+    # Forget the last build so that the next install rebuilds the repository
+    remove_stamp(stamp_dir, repository_name)
+
+    # Remove the shared memory of the sysrepo of this prefix
+    if repository_name == "sysrepo":
+        clean_sysrepo_shm(sysrepo_shm_prefix(prefix))
+
+    # Remove the build logs
+    if os.path.exists(repository_log_dir):
+        _remove_tree(repository_log_dir, trash_dir)
+        logger.info(f"Removed {repository_log_dir}")
 
     logger.info(f"Finished cleaning {repository_name}")
 
 
+def _remove_tree(path: str, trash_dir: str) -> None:
+    if trash_dir is None:
+        shutil.rmtree(path)
+    else:
+        move_to_trash(path, trash_dir)
+
+
+def uninstall(repository_name: str, build_dir: str, install_dir: str, keep: set = frozenset()) -> None:
+    """Removes the files installed by a repository, as listed in its CMake install manifest.
+
+    Directories left empty are removed as well.
+
+    Args:
+        repository_name (str): The name of the repository to uninstall.
+        build_dir (str): The directory where the build files are located.
+        install_dir (str): The directory where the installation files are located.
+        keep (set, optional): The files to keep because other repositories installed them too.
+
+    Returns:
+        None
+    """
+
+    files = read_manifest(os.path.join(build_dir, repository_name))
+    if not files:
+        logger.info(f"Nothing to uninstall for {repository_name}")
+        return
+
+    logger.info(f"Uninstalling {repository_name} from {install_dir}...")
+    directories = set()
+    removed = 0
+    for path in files:
+        if path in keep or not os.path.lexists(path):
+            continue
+        os.remove(path)
+        removed += 1
+        directory = os.path.dirname(path)
+        while directory.startswith(install_dir + os.sep) and directory not in directories:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+
+    # Remove the deepest directories first
+    for directory in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    logger.info(f"Removed {removed} files of {repository_name}")
+
+
+def update_mirror(repository_url: str, repository_name: str, mirror_dir: str, log) -> str:
+    """Creates or fetches the bare mirror of a repository.
+
+    Args:
+        repository_url (str): The URL of the Git repository.
+        repository_name (str): The name of the repository.
+        mirror_dir (str): The directory where the mirrors are stored.
+        log (file): The file the Git output is written to.
+
+    Returns:
+        str: The path to the mirror.
+    """
+
+    mirror = os.path.join(mirror_dir, f"{repository_name}.git")
+    if os.path.exists(mirror):
+        logger.info(f"Fetching {repository_name} into {mirror}...")
+        subprocess.run(["git", "remote", "set-url", "origin", repository_url],
+                       cwd=mirror, check=True, stdout=log, stderr=log)
+        subprocess.run(["git", "fetch", "--prune", "origin"],
+                       cwd=mirror, check=True, stdout=log, stderr=log)
+    else:
+        logger.info(f"Mirroring {repository_name} into {mirror}...")
+        os.makedirs(mirror_dir, exist_ok=True)
+        subprocess.run(["git", "clone", "--mirror", repository_url, mirror],
+                       check=True, stdout=log, stderr=log)
+    return mirror
+
+
+def _checkout(src_dir: str, branch: str, commit: str, log) -> None:
+    if commit:
+        logger.info(f"Checking out {commit}...")
+        subprocess.run(["git", "checkout", "--detach", commit],
+                       cwd=src_dir, check=True, stdout=log, stderr=log)
+    elif subprocess.run(["git", "rev-parse", "--verify", "--quiet", f"refs/heads/{branch}"],
+                        cwd=src_dir, stdout=log, stderr=log).returncode != 0:
+        logger.info(f"Checking out {branch}...")
+        subprocess.run(["git", "checkout", "-b", branch, f"origin/{branch}"],
+                       cwd=src_dir, check=True, stdout=log, stderr=log)
+    else:
+        # Local commits on the branch are kept, a branch that diverged from its remote is left to the developer
+        logger.info(f"Fast-forwarding {branch}...")
+        subprocess.run(["git", "checkout", branch], cwd=src_dir, check=True, stdout=log, stderr=log)
+        try:
+            subprocess.run(["git", "merge", "--ff-only", f"origin/{branch}"],
+                           cwd=src_dir, check=True, stdout=log, stderr=log)
+        except subprocess.CalledProcessError:
+            logger.error(f"{branch} in {src_dir} can not be fast-forwarded to origin/{branch}, "
+                         f"merge or rebase it by hand")
+            raise
+
+
+def sysrepo_shm_prefix(build_options: str) -> str:
+    """Returns the prefix of the sysrepo shared memory files of a prefix."""
+    return f"sr_{build_options}"
+
+
+def clean_sysrepo_shm(shm_prefix: str, shm_dir: str = SHM_DIR) -> None:
+    """Removes the shared memory files of one sysrepo instance.
+
+    Args:
+        shm_prefix (str): The shared memory prefix of the sysrepo instance.
+        shm_dir (str, optional): The shared memory directory.
+
+    Returns:
+        None
+    """
+
+    if not os.path.exists(shm_dir):
+        return
+
+    logger.debug(f"Removing {shm_prefix} from {shm_dir}...")
+    with os.scandir(shm_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith((f"{shm_prefix}_", f"{shm_prefix}sub_")):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                logger.info(f"Removed {entry.path}")
+            except FileNotFoundError:
+                pass
+
+
 def download_dependency(repository_url: str, repository_name: str, branch: str,
-                        commit: str, dest_dir: str, log_dir: str) -> None:
+                        commit: str, dest_dir: str, log_dir: str, mirror_dir: str) -> None:
     """Downloads a repository and switches to the specified branch.
 
+    The objects are fetched into a persistent bare mirror first, the fresh clone
+    borrows them from there.
+
     Args:
         repository_url (str): The URL of the Git repository.
         repository_name (str): The name of the repository.
         branch (str): The branch to switch to.
-        commit (str): The commit to switch to.
+        commit (str): The commit to switch to, the head of the branch if None.
         dest_dir (str): The directory where the repository will be downloaded.
         log_dir (str): The directory where the log files will be stored.
+        mirror_dir (str): The directory where the mirrors are stored.
 
     Returns:
         None
+
+    Raises:
+        subprocess.CalledProcessError: If Git fails.
     """
 
     logger.info(f"Downloading {repository_name}: "
@@ -124,39 +470,84 @@ def download_dependency(repository_url: str, repository_name: str, branch: str,
         shutil.rmtree(src_dir)
         logger.info(f"Removed old {repository_name} directory")
 
-    os.makedirs(src_dir)
-    logger.info(f"Created {repository_name} directory")
+    log_file = os.path.join(log_dir, f"{repository_name}.log")
+    try:
+        with open(log_file, 'w') as f:
+            mirror = update_mirror(repository_url, repository_name, mirror_dir, f)
+
+            logger.info(f"Cloning {repository_name}...")
+            subprocess.run(["git", "clone", "--no-checkout", "--reference", mirror, "--dissociate", repository_url,
+                            src_dir], check=True, stdout=f, stderr=f)
+            _checkout(src_dir, branch, commit, f)
+
+    except subprocess.CalledProcessError as e:
+        raise LoggedProcessError(e.returncode, e.cmd, log_file) from e
+
+    logger.info(f"Finished downloading {repository_name}")
+
+
+def update_dependency(repository_url: str, repository_name: str, branch: str,
+                      commit: str, dest_dir: str, log_dir: str, mirror_dir: str) -> None:
+    """Fetches a previously downloaded repository and switches to the specified commit.
+
+    Only the mirror talks to the remote, the checkout is fetched from the mirror.
+    Repositories that were not downloaded yet are downloaded.
+
+    Args:
+        repository_url (str): The URL of the Git repository.
+        repository_name (str): The name of the repository.
+        branch (str): The branch to switch to.
+        commit (str): The commit to switch to, the head of the branch if None.
+        dest_dir (str): The directory where the repository is downloaded.
+        log_dir (str): The directory where the log files will be stored.
+        mirror_dir (str): The directory where the mirrors are stored.
+
+    Returns:
+        None
+
+    Raises:
+        subprocess.CalledProcessError: If Git fails.
+    """
+
+    src_dir = os.path.join(dest_dir, repository_name)
+    if not os.path.exists(os.path.join(src_dir, ".git")):
+        download_dependency(repository_url, repository_name, branch, commit, dest_dir, log_dir, mirror_dir)
+        return
+
+    logger.info(f"Updating {repository_name}")
 
     log_file = os.path.join(log_dir, f"{repository_name}.log")
     try:
         with open(log_file, 'w') as f:
-            logger.info(f"Downloading {repository_name}...")
-            subprocess.run(["git", "clone", repository_url, "."],
-                           cwd=src_dir, check=True, stdout=f, stderr=f)
+            mirror = update_mirror(repository_url, repository_name, mirror_dir, f)
 
-            logger.info(f"Checking out {branch}...")
-            subprocess.run(["git", "checkout", branch],
-                           cwd=src_dir, check=True, stdout=f, stderr=f)
+            # Checkouts cloned before they were dissociated from the mirror still borrow its objects
+            alternates = os.path.join(src_dir, ".git", "objects", "info", "alternates")
+            if os.path.exists(alternates):
+                logger.info(f"Dissociating {repository_name} from {mirror}...")
+                subprocess.run(["git", "repack", "-a", "-d"], cwd=src_dir, check=True, stdout=f, stderr=f)
+                os.remove(alternates)
 
-            logger.info(f"Checking out {commit}...")
-            subprocess.run(["git", "checkout", commit],
+            subprocess.run(["git", "fetch", "--prune", "--tags", mirror, "+refs/heads/*:refs/remotes/origin/*"],
                            cwd=src_dir, check=True, stdout=f, stderr=f)
+            _checkout(src_dir, branch, commit, f)
 
     except subprocess.CalledProcessError as e:
-        logger.error(f"Error occurred: {e}")
-        logger.error(f"See {log_file} for more details")
-        exit(1)
+        raise LoggedProcessError(e.returncode, e.cmd, log_file) from e
 
-    logger.info(f"Finished downloading {repository_name}")
+    logger.info(f"Finished updating {repository_name}")
 
 
-def load_env(compiler: str, sanitizer: str, install_dir: str) -> dict:
+def load_env(compiler: str, sanitizer: str, install_dir: str, cflags: list = ("-g", "-O2"),
+             ldflags: list = ()) -> dict:
     """Loads environment variables from a file.
 
     Args:
         compiler (str): The compiler to use.
-        sanitizer (str): The sanitizer to use.
+        sanitizer (str): The sanitizer to use (clean, tsan or asan).
         install_dir (str): The path to the installation directory.
+        cflags (list, optional): The flags of the build profile added to CFLAGS and CXXFLAGS.
+        ldflags (list, optional): The flags of the build profile added to LDFLAGS.
 
     Returns:
         dict: A dictionary containing the environment variables.
@@ -171,7 +562,7 @@ def load_env(compiler: str, sanitizer: str, install_dir: str) -> dict:
     else:
         raise ValueError(f"Unknown compiler: {compiler}")
 
-    if sanitizer == "none":
+    if sanitizer in ("none", "clean"):
         env["CFLAGS"] = ""
         env["CXXFLAGS"] = ""
         env["LDFLAGS"] = ""
@@ -187,9 +578,10 @@ def load_env(compiler: str, sanitizer: str, install_dir: str) -> dict:
         env["LDFLAGS"] = "-fsanitize=address -fsanitize=undefined"
     
 
-    env["CFLAGS"] += " -g -O2"
-    env["CXXFLAGS"] += " -g -O2"
-    
+    env["CFLAGS"] = " ".join([env["CFLAGS"]] + list(cflags)).strip()
+    env["CXXFLAGS"] = " ".join([env["CXXFLAGS"]] + list(cflags)).strip()
+    env["LDFLAGS"] = " ".join([env["LDFLAGS"]] + list(ldflags)).strip()
+
     env["PATH"] = f"{install_dir}/bin:{install_dir}/share:{env['PATH']}"
     if 'LD_LIBRARY_PATH' not in env:
         env["LD_LIBRARY_PATH"] = f"{install_dir}/lib"
@@ -201,4 +593,8 @@ def load_env(compiler: str, sanitizer: str, install_dir: str) -> dict:
     else:
         env["PKG_CONFIG_PATH"] = f"{install_dir}/lib/pkgconfig:{env['PKG_CONFIG_PATH']}"
 
+    # Keep the sysrepo state of every prefix apart
+    env["SYSREPO_SHM_PREFIX"] = sysrepo_shm_prefix(os.path.basename(os.path.normpath(install_dir)))
+    env["SYSREPO_REPOSITORY_PATH"] = f"{install_dir}/sysrepo/repository"
+
     return env
@@ -0,0 +1,156 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The time without any changes after which a burst of saves is considered finished
+DEBOUNCE = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+IGNORED_DIRS = {".git", ".cache", "__pycache__"}
+
+
+def _ignored_file(name: str) -> bool:
+    # Editor backups, swap and lock files
+    return name.startswith(".#") or name.endswith(("~", ".swp", ".swx")) or name == "4913"
+
+
+class Inotify:
+    """A minimal wrapper of the Linux inotify API watching whole directory trees."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.paths = dict()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def add_tree(self, path: str) -> None:
+        """Watches a directory and all of its subdirectories.
+
+        Args:
+            path (str): The directory to watch.
+
+        Returns:
+            None
+        """
+
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [name for name in dirs if name not in IGNORED_DIRS]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(error, f"Failed to watch {root}: {os.strerror(error)}")
+            self.paths[wd] = root
+
+    def read(self, timeout: float = None) -> list:
+        """Waits for events.
+
+        Args:
+            timeout (float, optional): The maximal time to wait in seconds, forever if None.
+
+        Returns:
+            list: The (path, mask) tuples of the events, or an empty list on timeout. The
+                path is None if the kernel queue overflowed.
+        """
+
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        if not poll.poll(None if timeout is None else int(timeout * 1000)):
+            return list()
+
+        data = os.read(self.fd, 64 * 1024)
+        events = list()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if wd not in self.paths:
+                continue
+
+            path = os.path.join(self.paths[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.basename(path) not in IGNORED_DIRS:
+                    self.add_tree(path)
+            elif _ignored_file(os.path.basename(path)):
+                continue
+            events.append((path, mask))
+        return events
+
+
+def watch(source_dirs: dict, on_change, debounce: float = DEBOUNCE) -> None:
+    """Watches the source trees of repositories and reports which of them changed.
+
+    Bursts of changes are collected until nothing changes for the debounce interval.
+    Runs until interrupted.
+
+    Args:
+        source_dirs (dict): The source directories by repository name.
+        on_change (callable): Called with the set of names of the changed repositories.
+        debounce (float, optional): The quiet interval in seconds.
+
+    Returns:
+        None
+    """
+
+    inotify = Inotify()
+    roots = dict()
+    try:
+        for name, src_dir in source_dirs.items():
+            if not os.path.isdir(src_dir):
+                logger.warning(f"Not watching {name}, {src_dir} does not exist")
+                continue
+            inotify.add_tree(src_dir)
+            roots[os.path.join(src_dir, "")] = name
+        logger.info(f"Watching {len(roots)} repositories for changes...")
+
+        while True:
+            changed = set()
+            events = inotify.read()
+            while events:
+                for path, _ in events:
+                    if path is None:
+                        changed.update(roots.values())
+                        continue
+                    for root, name in roots.items():
+                        if path.startswith(root):
+                            changed.add(name)
+                            break
+                events = inotify.read(debounce)
+
+            if changed:
+                logger.info(f"Changed: {', '.join(sorted(changed))}")
+                on_change(changed)
+    finally:
+        inotify.close()